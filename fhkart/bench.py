@@ -0,0 +1,251 @@
+import logging
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from argparse import ArgumentParser
+from collections import deque
+
+import msgspec
+
+from .database import Database, DBInfo, IngestWriter
+from .gps import DBGPS
+from .helper import get_config_option
+from .payload import (
+    Payload,
+    decode_message,
+    encode_compact,
+    encode_points,
+    point_id,
+)
+from .player import Player
+from .server import BatchReceiverService, ReceiverService
+
+
+def udp_drops(port: int) -> int:
+    """Reads the kernel drop counter of the udp socket bound to ``port``.
+
+    Only works on linux, everywhere else it is always 0.
+    """
+    drops = 0
+    try:
+        with open("/proc/net/udp") as udp:
+            next(udp)
+            for line in udp:
+                fields = line.split()
+                local_port = int(fields[1].split(":")[1], 16)
+                if local_port == port:
+                    drops += int(fields[-1])
+    except OSError:
+        pass
+    return drops
+
+
+def percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+class LoadGenerator(threading.Thread):
+    """Sends payloads of synthetic players to a receiver.
+
+    Every player sends ``rate`` points per second, the players take turns.
+    ``wire_format`` is "payload" for the legacy Payload or one of the
+    WIRE_FORMAT values. The send time of every new point is kept in
+    ``sent_at`` under the id the receiver stores it with.
+    """
+
+    def __init__(
+        self, port: int, players: int, rate: float, duration: float, wire_format: str
+    ):
+        self.port = port
+        self.players = [Player(uuid.uuid4(), "127.0.0.1") for _ in range(players)]
+        self.interval = 1 / (rate * players)
+        self.duration = duration
+        self.wire_format = wire_format
+        self.batch_points = int(get_config_option("BATCH_POINTS"))
+        self.history = {
+            player.id: deque(maxlen=self.batch_points) for player in self.players
+        }
+        self.sent_at: dict[str, float] = {}
+        self.sent = 0
+
+        threading.Thread.__init__(self)
+
+    def encode(self, player: Player, seq: int) -> bytes:
+        gps = DBGPS.create()
+        points = self.history[player.id]
+        points.appendleft(gps)
+        if self.wire_format == "compact":
+            timestamp = round(gps.created_at.timestamp() * 1e6)
+            self.sent_at[str(point_id(player.id.bytes, timestamp))] = time.monotonic()
+        else:
+            self.sent_at[str(gps.id)] = time.monotonic()
+
+        if self.wire_format == "payload":
+            return msgspec.msgpack.encode(Payload(player, gps, seq, time.time()))
+        return encode_points(player, seq, list(points), self.wire_format)
+
+    def run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        start = time.monotonic()
+        next_send = start
+        while time.monotonic() - start < self.duration:
+            player = self.players[self.sent % len(self.players)]
+            packed = self.encode(player, self.sent // len(self.players) + 1)
+            sock.sendto(packed, ("127.0.0.1", self.port))
+            self.sent += 1
+
+            next_send += self.interval
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class IngestBenchmark:
+    """Measures the udp receive to sqlite commit pipeline.
+
+    Starts a real receiver and ingest writer on a scratch database and feeds
+    it over loopback. The latency of a point runs from sending it, which on
+    loopback is its receive time, to the commit of its row.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.latencies: list[float] = []
+        self.accepted = 0
+        self.last_commit = 0.0
+        self.generator = None
+
+    def on_flush(self, batch):
+        committed = time.monotonic()
+        self.last_commit = committed
+        self.accepted += len(batch)
+        for row in batch:
+            sent_at = self.generator.sent_at.pop(row[0], None)
+            if sent_at is not None:
+                self.latencies.append((committed - sent_at) * 1000)
+
+    def run(self):
+        args = self.args
+        db_path = args.db_path or os.path.join(tempfile.mkdtemp(), "bench.db")
+        (game, track) = Database.for_pre_init(db_path, args)
+        database = DBInfo(path=db_path, game=game, track=track)
+
+        writer = IngestWriter(database)
+        writer.listeners.append(self.on_flush)
+        if args.workers > 0:
+            receivers = [
+                BatchReceiverService(
+                    database, "127.0.0.1", args.port, reuse_port=args.workers > 1
+                )
+                for _ in range(args.workers)
+            ]
+        else:
+            receivers = [ReceiverService(database, "127.0.0.1", args.port)]
+        writer.daemon = True
+        writer.start()
+        for receiver in receivers:
+            receiver.daemon = True
+            receiver.start()
+        time.sleep(0.5)
+
+        drops_before = udp_drops(args.port)
+        generator = LoadGenerator(
+            args.port, args.players, args.rate, args.duration, args.wire_format
+        )
+        self.generator = generator
+        start = time.monotonic()
+        generator.start()
+        generator.join()
+
+        # Give the pipeline time to write what is still in flight
+        time.sleep(writer.flush_interval * 2 + 0.5)
+        elapsed = (self.last_commit or time.monotonic()) - start
+        drops = udp_drops(args.port) - drops_before
+
+        self.report(generator.sent, elapsed, drops)
+
+    def report(self, sent, elapsed, drops):
+        print(f"players:        {self.args.players} at {self.args.rate}/s each")
+        print(f"wire format:    {self.args.wire_format}")
+        print(f"sent:           {sent} ({sent / self.args.duration:.0f}/s)")
+        print(f"accepted:       {self.accepted} ({self.accepted / elapsed:.0f}/s)")
+        print(f"lost:           {sent - self.accepted}")
+        print(f"kernel drops:   {drops}")
+        for percent in [50, 95, 99]:
+            print(f"commit p{percent}:     {percentile(self.latencies, percent):.1f}ms")
+
+
+def codec_benchmark(iterations: int):
+    """Compares size, encode and decode time of the wire formats."""
+    player = Player(uuid.uuid4(), "127.0.0.1")
+    points = [DBGPS.create() for _ in range(5)]
+    encoders = {
+        "msgpack payload": lambda: msgspec.msgpack.encode(Payload(player, points[0])),
+        "msgpack batch": lambda: encode_points(player, 1, points, "msgpack"),
+        "compact": lambda: encode_compact(player, 1, points[0]),
+    }
+
+    for name, encode in encoders.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            message = encode()
+        encode_time = (time.perf_counter() - start) / iterations
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode_message(message)
+        decode_time = (time.perf_counter() - start) / iterations
+
+        print(
+            f"{name:16} {len(message):4} bytes  "
+            f"encode {encode_time * 1e6:6.2f}us  decode {decode_time * 1e6:6.2f}us"
+        )
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = ArgumentParser(prog="CPSFHKartBench")
+    parser.add_argument("--players", default=20, type=int)
+    parser.add_argument(
+        "--rate", default=5, help="Points per second per player", type=float
+    )
+    parser.add_argument("--duration", default=10, help="Seconds to send", type=float)
+    parser.add_argument("--port", default=43900, type=int)
+    parser.add_argument(
+        "--workers",
+        default=0,
+        help="Batch receive workers, 0 uses the plain receiver",
+        type=int,
+    )
+    parser.add_argument(
+        "--wire-format",
+        default="payload",
+        choices=["payload", "msgpack", "compact"],
+        help="payload sends the legacy Payload, the others like WIRE_FORMAT",
+    )
+    parser.add_argument("--db-path", help="Defaults to a scratch database")
+    parser.add_argument("--track-path", default="./tracks/FHtrack12_125809.gpx")
+
+    parser.add_argument(
+        "--codec",
+        action="store_true",
+        help="Only run the encode/decode micro benchmark",
+    )
+    parser.add_argument("--iterations", default=100000, type=int)
+
+    args = parser.parse_args()
+    if args.codec:
+        codec_benchmark(args.iterations)
+    else:
+        IngestBenchmark(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import threading
+from collections import deque
+
+from .gps import DBGPS
+from .helper import get_config_option
+
+
+class LiveCache:
+    """Newest points of every player, kept in memory.
+
+    The ingest path pushes every point it queues and the hot readers are
+    served from here. Sqlite stays the durable log. Every player has a ring
+    buffer with the last ``size`` points, newest first.
+    """
+
+    def __init__(self, size=None):
+        self.size = int(size or get_config_option("PLAYER_POINTS"))
+        self.lock = threading.Lock()
+        self.points: dict[tuple[int, str], deque[DBGPS]] = {}
+
+    def push(self, game_id: int, player_id, gps: DBGPS) -> bool:
+        """Adds the newest point of a player and returns if it was new.
+
+        Points that are already in the buffer are ignored, batches repeat
+        points that were sent before.
+        """
+        key = (game_id, str(player_id))
+        with self.lock:
+            points = self.points.get(key)
+            if points is None:
+                points = deque(maxlen=self.size)
+                self.points[key] = points
+            elif any(point.id == gps.id for point in points):
+                return False
+            points.appendleft(gps)
+            return True
+
+    def seed(self, game_id: int, player_id, points: list[DBGPS]):
+        """Caches points loaded from sqlite, newest first.
+
+        A player without points is cached empty, so it is not loaded again.
+        Players that got a point in the meantime are left alone.
+        """
+        key = (game_id, str(player_id))
+        with self.lock:
+            if key not in self.points:
+                self.points[key] = deque(points, maxlen=self.size)
+
+    def has(self, game_id: int, player_id) -> bool:
+        with self.lock:
+            return (game_id, str(player_id)) in self.points
+
+    def newest(self, game_id: int, player_id) -> DBGPS | None:
+        with self.lock:
+            points = self.points.get((game_id, str(player_id)))
+            if not points:
+                return None
+            return points[0]
+
+    def latest(self, game_id: int, player_id, limit=None) -> list[DBGPS]:
+        """Returns up to ``limit`` points of a player, newest first."""
+        with self.lock:
+            points = list(self.points.get((game_id, str(player_id)), ()))
+        return points[:limit]
+
+    def clear(self):
+        with self.lock:
+            self.points.clear()
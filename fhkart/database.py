@@ -1,14 +1,107 @@
 import logging
+import os
+import pathlib
+import queue
 import sqlite3
+import threading
+import time
 import uuid
 from datetime import datetime
 
 import msgspec
+import numpy as np
 
+from .cache import LiveCache
 from .game import Game
 from .gps import DBGPS, GPSBase, Track
-from .payload import Payload
-from .player import Player, PlayerPoints
+from .helper import get_config_option
+from .metrics import metrics
+from .payload import BatchPayload, Payload
+from .player import Player, PlayerPoints, PlayerRegistry
+
+
+migrations = [
+    [
+        "CREATE TABLE IF NOT EXISTS location_data(id TEXT PRIMARY KEY, x REAL, y REAL, created_at TIMESTAMP, player_id TEXT, game_id INTEGER, is_target BOOLEAN DEFAULT FALSE)",
+        "CREATE TABLE IF NOT EXISTS players(id TEXT PRIMARY KEY, active BOOLEAN, me BOOLEAN, address TEXT)",
+        "CREATE TABLE IF NOT EXISTS games(id INTEGER PRIMARY KEY, target_x REAL, target_y REAL, created_at TIMESTAMP)",
+    ],
+    [
+        "CREATE INDEX IF NOT EXISTS location_data_game_player_created ON location_data(game_id, player_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS location_data_targets ON location_data(game_id) WHERE is_target = TRUE",
+        "CREATE INDEX IF NOT EXISTS players_active ON players(active) WHERE active = TRUE",
+    ],
+    [
+        "CREATE TABLE IF NOT EXISTS game_targets(game_id INTEGER, seq INTEGER, x REAL, y REAL, PRIMARY KEY (game_id, seq))",
+        "INSERT OR IGNORE INTO game_targets (game_id, seq, x, y) SELECT game_id, ROW_NUMBER() OVER (PARTITION BY game_id ORDER BY rowid) - 1, x, y FROM location_data WHERE is_target = TRUE",
+        "DELETE FROM location_data WHERE is_target = TRUE",
+        "DROP INDEX IF EXISTS location_data_targets",
+    ],
+]
+
+
+def unix_micros(created_at: datetime | str) -> int:
+    """Unix time in microseconds of a naive local timestamp."""
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return round(created_at.timestamp() * 1e6)
+
+
+class ExportedPlayer(msgspec.Struct):
+    """Slice of one player in the exported columns."""
+
+    id: str
+    offset: int
+    count: int
+
+
+class ExportHeader(msgspec.Struct):
+    """Header of a columnar telemetry export.
+
+    The columns are raw little endian files next to the header: ``lat.f64``,
+    ``lon.f64`` and ``timestamp.i64`` (unix time in microseconds, like the
+    wire formats). Points of a player are contiguous and ordered by time.
+    Version 1 exports stored naive local time instead.
+    """
+
+    version: int
+    game: Game
+    points: int
+    players: list[ExportedPlayer]
+
+
+class TelemetryExport:
+    """Reads a columnar telemetry export.
+
+    The columns are memory mapped, so nothing is loaded until it is used and
+    there are no python objects per point.
+    """
+
+    columns = {
+        "lat": ("lat.f64", "<f8"),
+        "lon": ("lon.f64", "<f8"),
+        "timestamp": ("timestamp.i64", "<i8"),
+    }
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "header.json"), "rb") as header:
+            self.header = msgspec.json.decode(header.read(), type=ExportHeader)
+
+        for column, (file, dtype) in self.columns.items():
+            file = os.path.join(path, file)
+            if self.header.points > 0:
+                data = np.memmap(file, dtype=dtype, mode="r")
+            else:
+                data = np.empty(0, dtype=dtype)
+            setattr(self, column, data)
+
+    def player(self, id) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns lat, lon and timestamp arrays of one player."""
+        for player in self.header.players:
+            if player.id == str(id):
+                part = slice(player.offset, player.offset + player.count)
+                return self.lat[part], self.lon[part], self.timestamp[part]
+        raise KeyError(id)
 
 
 class DBInfo(msgspec.Struct):
@@ -17,6 +110,50 @@ class DBInfo(msgspec.Struct):
     track: Track
 
 
+class ConnectionManager:
+    """Hands out sqlite connections for one database file.
+
+    The database runs in WAL mode. Writer connections are pooled per thread,
+    reader connections are opened read only. Readers see the last committed
+    state and never wait for the ingest, and the ingest never waits for them.
+    """
+
+    managers: dict[str, "ConnectionManager"] = {}
+    lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.busy_timeout = float(get_config_option("DB_BUSY_TIMEOUT"))
+        self.synchronous = get_config_option("DB_SYNCHRONOUS")
+        self.local = threading.local()
+
+    @classmethod
+    def for_path(cls, path: str) -> "ConnectionManager":
+        with cls.lock:
+            if path not in cls.managers:
+                cls.managers[path] = ConnectionManager(path)
+            return cls.managers[path]
+
+    def writer(self) -> sqlite3.Connection:
+        """Returns the writer connection of the current thread."""
+        con = getattr(self.local, "writer", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(f"PRAGMA synchronous={self.synchronous}")
+            self.local.writer = con
+        return con
+
+    def reader(self) -> sqlite3.Connection:
+        """Returns the read only connection of the current thread."""
+        con = getattr(self.local, "reader", None)
+        if con is None:
+            uri = f"{pathlib.Path(self.path).absolute().as_uri()}?mode=ro"
+            con = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout)
+            self.local.reader = con
+        return con
+
+
 class DBWrapper:
     def __init__(self, db_info: DBInfo):
         self.database = Database(db_info)
@@ -33,7 +170,15 @@ class Database:
     me: Player
     game: Game
     track: Track
-    active_players: list[Player] = []
+    active_players: list[PlayerPoints] = []
+    registry: PlayerRegistry = PlayerRegistry()
+    games: dict[int, Game] = {}
+    ingest_queue: queue.Queue = queue.Queue(
+        maxsize=int(get_config_option("INGEST_QUEUE_SIZE"))
+    )
+    ingest_dropped: int = 0
+    ingest_lock: threading.Lock = threading.Lock()
+    live_cache: LiveCache = LiveCache()
 
     def __init__(self, database: DBInfo):
         self.__db_path = database.path
@@ -42,24 +187,24 @@ class Database:
 
     @classmethod
     def for_pre_init(self, database: str, args):
+        track = Track(args.track_path)
         db = Database(
             DBInfo(
                 database,
                 Game(0, target=[GPSBase(54.332262, 10.180552)]),
-                Track(args.track_path),
+                track,
             )
         )
         db.connect()
         db.create_tables()
         db.flash_all_players()
+        db.me = db.get_my_player_and_game()
 
         game = db.select_newest_game()
         game_id = 0
         if game:
             game_id = game.id + 1
 
-        track = Track(args.track_path)
-
         # [
         #     GPSBase(args.target_gps_x, args.target_gps_y),
         #     GPSBase(args.target_gps_x + 0.001, args.target_gps_y + 0.001),
@@ -70,16 +215,34 @@ class Database:
 
         return game, track
 
-    def connect(self):
-        self.__con = sqlite3.connect(self.__db_path)
+    @classmethod
+    def for_maintenance(cls, database: str):
+        """Opens a database for maintenance commands.
+
+        There is no running game or track, so only the table queries work.
+        """
+        db = Database(DBInfo(database, Game(0, target=[]), None))
+        db.connect()
+        db.create_tables()
+        return db
+
+    def connect(self, read_only=False):
+        connections = ConnectionManager.for_path(self.__db_path)
+        if read_only:
+            self.__con = connections.reader()
+        else:
+            self.__con = connections.writer()
 
-    def post_init(self):
+    def post_init(self, read_only=False):
         """Initiates DB connection.
 
         This is needed so all threads can initiate their own db connections.
+        Threads that only query should pass ``read_only`` so they never block
+        the writers.
         """
-        self.connect()
+        self.connect(read_only)
         self.me = self.get_my_player_and_game()
+        self.registry.add(self.me)
 
     def __cursor(self):
         return self.__con.cursor()
@@ -87,6 +250,9 @@ class Database:
     def commit(self):
         self.__con.commit()
 
+    def rollback(self):
+        self.__con.rollback()
+
     def get_my_player_and_game(self):
         """Gets this player out of db.
 
@@ -107,21 +273,40 @@ class Database:
         self.commit()
         if db_player is not None:
             (id, address, me) = db_player
-            return Player(id, address)
+            return Player(id, address, me=bool(me))
         else:
             return self.create_new_player(uuid.uuid4(), "localhost", me=True)
 
     def create_tables(self):
-        """Create tables."""
-        queries = [
-            "CREATE TABLE IF NOT EXISTS location_data(id TEXT PRIMARY KEY, x REAL, y REAL, created_at TIMESTAMP, player_id TEXT, game_id INTEGER, is_target BOOLEAN DEFAULT FALSE)",
-            "CREATE TABLE IF NOT EXISTS players(id TEXT PRIMARY KEY, active BOOLEAN, me BOOLEAN, address TEXT)",
-            "CREATE TABLE IF NOT EXISTS games(id INTEGER PRIMARY KEY, target_x REAL, target_y REAL, created_at TIMESTAMP)",
-        ]
+        """Create tables.
+
+        Runs all migrations the database has not seen yet, so existing
+        databases are upgraded in place.
+        """
         cursor = self.__cursor()
-        for query in queries:
-            cursor.execute(query)
-        self.commit()
+        cursor.execute("CREATE TABLE IF NOT EXISTS schema_version(version INTEGER)")
+        self.migrate()
+
+    def schema_version(self) -> int:
+        cursor = self.__cursor()
+        version = cursor.execute("SELECT MAX(version) FROM schema_version").fetchone()
+        return version[0] or 0
+
+    def migrate(self):
+        """Applies every migration newer than the stored schema version.
+
+        Migrations are plain lists of queries, the version is the position in
+        ``migrations``. Queries have to be safe to run twice, databases from
+        before the version table start at version 0.
+        """
+        cursor = self.__cursor()
+        version = self.schema_version()
+        for number, queries in enumerate(migrations[version:], start=version + 1):
+            for query in queries:
+                cursor.execute(query)
+            cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (number,))
+            self.commit()
+            logging.info(f"Migrated database to schema version {number}")
 
     def flash_all_players(self):
         """Sets all players to unactive.
@@ -134,35 +319,57 @@ class Database:
         self.commit()
 
     def check_player_and_insert(self, player):
-        if not self.check_player(player):
-            logging.debug(f"Added new active Player {player}")
-            player = self.create_new_player(player.id, player.address)
-        self.active_players.append(player)
-        return player
+        """Registers a player that sent a packet.
+
+        The registry answers from memory, the database is only written when
+        the player is new, came back or changed its address.
+        """
+        known, change = self.registry.observe(player)
+        if change == "new":
+            # Players from an earlier run are activated by check_player
+            if not self.check_player(known):
+                logging.debug(f"Added new active Player {known}")
+                self.create_new_player(known.id, known.address)
+        elif change is not None:
+            self.update_player(known)
+            logging.info(
+                f"Player {known.id} is {change}. Current player: {len(self.registry.active())}"
+            )
+        return known
 
     def check_player(self, player):
+        """Activates a player that is already in the database."""
         cursor = self.__cursor()
-        update_query = "UPDATE players SET active=true WHERE id = ?"
-        select_query = "SELECT id, address, active, me FROM players WHERE id = ?"
+        select_query = "SELECT id FROM players WHERE id = ?"
 
         db_player = cursor.execute(select_query, (str(player.id),)).fetchone()
         if db_player is None:
             return False
 
-        if not bool(db_player[2]):
-            cursor.execute(update_query, (str(player.id),))
-            logging.info(
-                f"New Player joined the Game! Current player: {len(self.active_players)}"
-            )
-            self.commit()
+        self.update_player(player)
+        logging.info(
+            f"New Player joined the Game! Current player: {len(self.registry.active())}"
+        )
         return True
 
+    def update_player(self, player):
+        cursor = self.__cursor()
+        query = "UPDATE players SET active = ?, address = ? WHERE id = ?"
+        cursor.execute(query, (player.active, player.address, str(player.id)))
+        self.commit()
+
+    def deactivate_expired_players(self):
+        """Sets players to inactive that did not send anything for a while."""
+        for player in self.registry.expire():
+            self.update_player(player)
+            logging.info(f"Player {player.id} timed out")
+
     def create_new_player(self, id, address, me=False):
         player = Player(id, address, True, me)
         self.insert_player(player)
         self.commit()
         logging.info(
-            f"New Player joined the Game! Current player: {len(self.active_players)}"
+            f"New Player joined the Game! Current player: {len(self.registry.active())}"
         )
         return player
 
@@ -171,45 +378,80 @@ class Database:
         self.commit()
         return id
 
-    def select_active_players(self):
-        cursor = self.__cursor()
-        player_query = """
-        SELECT id, address, active, me FROM players
-        WHERE active=true
-        """
-        point_query = """
-        SELECT x, y, id, created_at FROM location_data
-        WHERE game_id = ? AND player_id = ?
-        ORDER BY created_at DESC
-        LIMIT 10
+    def select_active_players(self, limit=None):
+        """Selects all active players with their newest points.
+
+        Players come from the registry and points from the live cache. Players
+        that are not in the cache yet are loaded from sqlite once, also when
+        they have no points.
         """
-        db_active_players = cursor.execute(player_query).fetchall()
-
-        active_players = []
-
-        for player in db_active_players:
-            locations = cursor.execute(
-                point_query,
-                (
-                    self.game.id,
-                    str(player[0]),
-                ),
-            ).fetchall()
-            active_players.append(
-                PlayerPoints(
-                    id=player[0],
-                    address=player[1],
-                    active=bool(player[2]),
-                    me=bool(player[3]),
-                    points=[DBGPS(gps[0], gps[1], gps[2], gps[3]) for gps in locations],
+        if limit is None:
+            limit = int(get_config_option("PLAYER_POINTS"))
+
+        players = self.registry.active()
+        missing = [
+            player.id
+            for player in players
+            if not self.live_cache.has(self.game.id, player.id)
+        ]
+        if missing:
+            loaded = self.query_newest_points(missing, limit)
+            for player_id in missing:
+                self.live_cache.seed(
+                    self.game.id, player_id, loaded.get(str(player_id), [])
                 )
+
+        self.active_players = [
+            PlayerPoints(
+                id=player.id,
+                address=player.address,
+                active=player.active,
+                me=player.me,
+                points=self.live_cache.latest(self.game.id, player.id, limit),
             )
+            for player in players
+        ]
+        return self.active_players
 
-        self.active_players = active_players
-        return active_players
+    def query_newest_points(self, player_ids, limit) -> dict[str, list[DBGPS]]:
+        """Loads the newest points of some players from sqlite, newest first.
+
+        One query for all players. The newest ``limit`` points of each player
+        are picked by a correlated subquery on the location index, so the cost
+        grows with the number of players but not with the length of the game.
+        """
+        cursor = self.__cursor()
+        ids = [str(player_id) for player_id in player_ids]
+        query = f"""
+        SELECT players.id, location_data.x, location_data.y, location_data.id,
+               location_data.created_at
+        FROM players
+        JOIN location_data ON location_data.id IN (
+            SELECT newest.id FROM location_data AS newest
+            WHERE newest.game_id = ? AND newest.player_id = players.id
+            ORDER BY newest.created_at DESC
+            LIMIT ?
+        )
+        WHERE players.id IN ({", ".join("?" * len(ids))})
+        ORDER BY players.id, location_data.created_at DESC
+        """
+        rows = cursor.execute(query, (self.game.id, limit, *ids)).fetchall()
+
+        points: dict[str, list[DBGPS]] = {}
+        for row in rows:
+            points.setdefault(row[0], []).append(DBGPS(row[1], row[2], row[3], row[4]))
+        return points
 
     def select_newest_point(self, player_id) -> DBGPS | None:
-        """Selects my newest gps data."""
+        """Selects the newest gps data of a player.
+
+        Served from the live cache, sqlite is only asked for players that
+        are not cached. A player that is cached without points has none.
+        """
+        gps = self.live_cache.newest(self.game.id, player_id)
+        if gps is not None or self.live_cache.has(self.game.id, player_id):
+            return gps
+
         cursor = self.__cursor()
         query = "SELECT id, x, y, created_at FROM location_data WHERE player_id = ? AND game_id = ? ORDER BY created_at DESC LIMIT 1"
 
@@ -228,46 +470,129 @@ class Database:
     def select_my_newest_point(self) -> DBGPS | None:
         return self.select_newest_point(self.me.id)
 
-    def game_parser(self, rows):
-        return Game(
-            rows[0][0], target=[GPSBase(target[1], target[2]) for target in rows]
-        )
+    def select_my_newest_points(self, limit) -> list[DBGPS]:
+        """Selects my newest points from the live cache, newest first."""
+        return self.live_cache.latest(self.game.id, self.me.id, limit)
 
     def select_game(self, id) -> Game:
-        query = """
-        SELECT games.id, x, y FROM games
-        JOIN location_data ON games.id = location_data.game_id
-        WHERE games.id = ? AND is_target = TRUE
+        """Selects a game with its targets.
+
+        Games never change once they are created, so they are cached.
         """
+        game = self.games.get(id)
+        if game is not None:
+            return game
+
+        query = "SELECT x, y FROM game_targets WHERE game_id = ? ORDER BY seq"
         cursor = self.__cursor()
         result = cursor.execute(
             query,
             (id,),
         ).fetchall()
-        game = self.game_parser(result)
+        game = Game(id, target=[GPSBase(x, y) for (x, y) in result])
+        self.games[id] = game
         return game
 
     def select_newest_game(self) -> Game | None:
+        cursor = self.__cursor()
+        (id,) = cursor.execute("SELECT MAX(id) FROM games").fetchone()
+        if id is None:
+            return None
+        return self.select_game(id)
+
+    def select_game_ids(self) -> list[int]:
+        """Selects all game ids, newest first."""
+        cursor = self.__cursor()
+        rows = cursor.execute("SELECT id FROM games ORDER BY id DESC").fetchall()
+        return [row[0] for row in rows]
+
+    def select_game_points(self, game_id) -> list[tuple[str, DBGPS]]:
+        """Selects all player points of a game, ordered by player and time."""
         query = """
-        SELECT games.id, x, y FROM games
-        JOIN location_data ON games.id = location_data.game_id
-        WHERE is_target = TRUE
-        ORDER BY games.id DESC LIMIT 1
+        SELECT player_id, x, y, id, created_at FROM location_data
+        WHERE game_id = ?
+        ORDER BY player_id, created_at
         """
         cursor = self.__cursor()
-        result = cursor.execute(query).fetchall()
-        if len(result) < 1:
-            return None
-        return self.game_parser(result)
+        rows = cursor.execute(query, (game_id,)).fetchall()
+        return [(row[0], DBGPS(row[1], row[2], row[3], row[4])) for row in rows]
+
+    def delete_points(self, ids):
+        cursor = self.__cursor()
+        cursor.executemany(
+            "DELETE FROM location_data WHERE id = ?", [(str(id),) for id in ids]
+        )
+
+    def delete_game(self, game_id):
+        """Deletes a game with all its points and targets."""
+        cursor = self.__cursor()
+        cursor.execute("DELETE FROM location_data WHERE game_id = ?", (game_id,))
+        cursor.execute("DELETE FROM game_targets WHERE game_id = ?", (game_id,))
+        cursor.execute("DELETE FROM games WHERE id = ?", (game_id,))
+        self.games.pop(game_id, None)
+
+    def export_game(self, game_id, path: str) -> ExportHeader:
+        """Writes the telemetry of a game as columns for TelemetryExport.
+
+        Rows are streamed from sqlite in chunks straight into the column
+        files.
+        """
+        cursor = self.__cursor()
+        counts = cursor.execute(
+            """
+            SELECT player_id, COUNT(*) FROM location_data WHERE game_id = ?
+            GROUP BY player_id ORDER BY player_id
+            """,
+            (game_id,),
+        ).fetchall()
+
+        players = []
+        offset = 0
+        for player_id, count in counts:
+            players.append(ExportedPlayer(player_id, offset, count))
+            offset += count
+
+        query = """
+        SELECT x, y, created_at FROM location_data WHERE game_id = ?
+        ORDER BY player_id, created_at
+        """
+        os.makedirs(path, exist_ok=True)
+        files = {
+            column: open(os.path.join(path, file), "wb")
+            for column, (file, dtype) in TelemetryExport.columns.items()
+        }
+        try:
+            cursor.execute(query, (game_id,))
+            while rows := cursor.fetchmany(65536):
+                (lat, lon, created_at) = zip(*rows)
+                np.array(lat, dtype="<f8").tofile(files["lat"])
+                np.array(lon, dtype="<f8").tofile(files["lon"])
+                np.array(
+                    [unix_micros(timestamp) for timestamp in created_at], dtype="<i8"
+                ).tofile(files["timestamp"])
+        finally:
+            for file in files.values():
+                file.close()
+
+        header = ExportHeader(2, self.select_game(game_id), offset, players)
+        with open(os.path.join(path, "header.json"), "wb") as file:
+            file.write(msgspec.json.encode(header))
+        logging.info(f"Exported {offset} points of game {game_id} to {path}")
+        return header
+
+    def vacuum(self):
+        """Gives the space of deleted rows back to the file system."""
+        self.commit()
+        self.__con.execute("VACUUM")
 
     def insert_game(self, game: Game):
         query = (
             "INSERT INTO games (id, target_x, target_y, created_at) VALUES (?, ?, ?, ?)"
         )
 
-        points_query = """
-        INSERT INTO location_data (id, x, y, created_at, player_id, game_id, is_target) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
+        targets_query = (
+            "INSERT INTO game_targets (game_id, seq, x, y) VALUES (?, ?, ?, ?)"
+        )
         cursor = self.__cursor()
 
         cursor.execute(
@@ -280,7 +605,8 @@ class Database:
             ),
         )
 
-        cursor.executemany(points_query, game.target_as_tuples(game.id))
+        cursor.executemany(targets_query, game.target_as_tuples(game.id))
+        self.games[game.id] = game
 
         return game
 
@@ -292,28 +618,198 @@ class Database:
             query, (str(player.id), player.address, player.active, player.me)
         )
 
+    def gps_row(self, gps, player, created_at=None):
+        return (
+            str(gps.id),
+            gps.x,
+            gps.y,
+            created_at or datetime.now(),
+            str(player.id),
+            self.game.id,
+        )
+
     def insert_gps(self, gps, player):
         """Inserts gps data.
 
         Ignores it if it already exists in the database
         """
+        self.insert_gps_rows([self.gps_row(gps, player)])
+
+    def insert_gps_rows(self, rows):
+        """Inserts many gps rows in one statement."""
         query = "INSERT OR IGNORE INTO location_data (id, x, y, created_at, player_id, game_id) VALUES (?, ?, ?, ?, ?, ?)"
         cursor = self.__cursor()
 
-        cursor.execute(
-            query,
-            (
-                str(gps.id),
-                gps.x,
-                gps.y,
-                datetime.now(),
-                str(player.id),
-                self.game.id,
-            ),
-        )
+        cursor.executemany(query, rows)
+
+    def queue_gps(self, gps, player):
+        """Hands gps data to the ingest writer.
+
+        The point is written with the next batch of the IngestWriter thread
+        and is visible in the live cache right away.
+        """
+        self.queue_gps_rows([self.gps_row(gps, player)])
+
+    def batch_rows(self, points: list[DBGPS], player):
+        """Rows for the points of a batch, oldest first.
 
-    def insert_payload(self, payload: Payload):
+        Points come newest first. They keep their distance in time to the
+        newest point, which gets the receive time.
+        """
+        received = datetime.now()
+        newest = points[0].created_at
+        return [
+            self.gps_row(gps, player, received - (newest - gps.created_at))
+            for gps in reversed(points)
+        ]
+
+    def queue_gps_rows(self, rows):
+        """Hands rows to the ingest writer, they are written in one transaction.
+
+        Only rows with points that are new to the live cache are queued, the
+        repeated points of a batch are already on their way to sqlite. When
+        the writer can not keep up and the queue is full the rows are
+        dropped and counted in ``ingest_dropped``.
+        """
+        new_rows = []
+        for row in rows:
+            (id, x, y, created_at, player_id, game_id) = row
+            if self.live_cache.push(game_id, player_id, DBGPS(x, y, id, created_at)):
+                new_rows.append(row)
+        if not new_rows:
+            return
+        rows = new_rows
+        try:
+            self.ingest_queue.put_nowait((time.monotonic(), rows))
+        except queue.Full:
+            logging.warning(f"Ingest queue is full, dropped {len(rows)} points")
+            self.count_dropped(len(rows))
+
+    @classmethod
+    def count_dropped(cls, rows: int):
+        with cls.ingest_lock:
+            cls.ingest_dropped += rows
+
+    def payload_rows(self, payload: Payload | BatchPayload):
         player = self.check_player_and_insert(payload.player)
-        if not player.me:
-            self.insert_gps(payload.gps, payload.player)
-        self.commit()
+        if player.me:
+            return []
+        if isinstance(payload, BatchPayload):
+            points = payload.points()
+            return self.batch_rows(points, player) if points else []
+        return [self.gps_row(payload.gps, player)]
+
+    def insert_payload(self, payload: Payload | BatchPayload):
+        rows = self.payload_rows(payload)
+        if rows:
+            self.queue_gps_rows(rows)
+
+    def insert_payloads(self, payloads: list[Payload | BatchPayload]):
+        """Inserts many payloads in one transaction."""
+        rows = [row for payload in payloads for row in self.payload_rows(payload)]
+        if rows:
+            self.queue_gps_rows(rows)
+
+
+class IngestWriter(threading.Thread, DBWrapper):
+    """Single writer for location data.
+
+    Producers only put rows into the ingest queue. This thread drains it and
+    writes the points in batched transactions, so there is one commit per
+    batch instead of one per point. Callables in ``listeners`` get every
+    batch after it is committed.
+    """
+
+    def __init__(self, database, flush_interval=None, batch_size=None):
+        DBWrapper.__init__(self, database)
+        self.flush_interval = float(
+            flush_interval or get_config_option("INGEST_FLUSH_INTERVAL")
+        )
+        self.batch_size = int(batch_size or get_config_option("INGEST_BATCH_SIZE"))
+        self.retries = int(get_config_option("INGEST_RETRIES"))
+        self.queue = self.database.ingest_queue
+        self.listeners = []
+        self.pending = None
+        self.failures = 0
+        metrics.gauge("ingest_queue", self.queue.qsize)
+        metrics.gauge("ingest_dropped", lambda: Database.ingest_dropped)
+        metrics.gauge("active_players", lambda: len(self.database.registry.active()))
+
+        threading.Thread.__init__(self)
+
+    def run(self):
+        self.database.connect()
+        logging.debug("Ingest writer started")
+        while not self.exit:
+            self.write(*(self.pending or self.collect()))
+            try:
+                self.database.deactivate_expired_players()
+            except sqlite3.Error:
+                logging.exception("Ingest writer could not expire players")
+                self.database.rollback()
+
+        # Write whatever is left before shutting down
+        while self.pending or not self.queue.empty():
+            self.write(*(self.pending or self.collect()))
+
+    def write(self, batch, queued=()):
+        """Flushes a batch and keeps it for a retry if the database fails.
+
+        After ``INGEST_RETRIES`` failed attempts the batch is dropped, so a
+        broken batch can not block the writer forever.
+        """
+        try:
+            self.flush(batch, queued)
+        except sqlite3.Error:
+            logging.exception(f"Ingest writer could not write {len(batch)} points")
+            self.database.rollback()
+            self.failures += 1
+            if self.failures < self.retries:
+                self.pending = (batch, queued)
+                time.sleep(self.flush_interval)
+                return
+            logging.error(f"Ingest writer dropped {len(batch)} points")
+            Database.count_dropped(len(batch))
+        self.pending = None
+        self.failures = 0
+
+    def collect(self):
+        """Collects a batch of rows.
+
+        Waits up to the flush interval for the first rows, then keeps
+        collecting until the batch is full or the interval is over. Rows that
+        were queued together always end up in the same batch. Returns the rows
+        and the times they were queued at.
+        """
+        try:
+            (queued_at, rows) = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return [], []
+        batch = list(rows)
+        queued = [queued_at]
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                (queued_at, rows) = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.extend(rows)
+            queued.append(queued_at)
+        return batch, queued
+
+    def flush(self, batch, queued=()):
+        if not batch:
+            return
+        self.database.insert_gps_rows(batch)
+        self.database.commit()
+        logging.debug(f"Ingest writer flushed {len(batch)} points")
+
+        committed = time.monotonic()
+        for queued_at in queued:
+            metrics.observe("insert_to_commit", (committed - queued_at) * 1000)
+        for listener in self.listeners:
+            listener(batch)
@@ -0,0 +1,161 @@
+import logging
+
+import numpy as np
+
+from .gps import DBGPS, LocalProjection
+from .helper import get_config_option
+from .metrics import metrics
+
+
+class GPSFilter:
+    """Cleans the fixes of one GPS source before they are stored.
+
+    The stages of FILTER_<SOURCE> run in this order:
+
+    - "outlier" drops fixes that need more than FILTER_MAX_SPEED from the
+      last kept fix. After FILTER_MAX_REJECTS drops in a row the new
+      position is taken as it is, the kart really moved.
+    - "kalman" smooths positions with a constant velocity Kalman filter in
+      local metres.
+    - "movement" drops fixes that moved less than FILTER_MIN_MOVEMENT from
+      the last kept fix.
+
+    Counters per source are exported as gauges.
+    """
+
+    stages = ("outlier", "kalman", "movement")
+
+    def __init__(self, source: str, stages=None):
+        self.source = source
+        if stages is None:
+            stages = get_config_option(f"FILTER_{source.upper()}")
+        if isinstance(stages, str):
+            stages = [stage.strip() for stage in stages.split(",") if stage.strip()]
+        unknown = set(stages) - set(self.stages) - {"none"}
+        if unknown:
+            raise ValueError(f"Unknown GPS filter stages {', '.join(unknown)}")
+        self.enabled = set(stages)
+
+        self.max_speed = float(get_config_option("FILTER_MAX_SPEED"))
+        self.max_rejects = int(get_config_option("FILTER_MAX_REJECTS"))
+        self.min_movement = float(get_config_option("FILTER_MIN_MOVEMENT"))
+        self.kalman = Kalman(
+            float(get_config_option("FILTER_PROCESS_NOISE")),
+            float(get_config_option("FILTER_MEASUREMENT_NOISE")),
+        )
+
+        self.projection = None
+        self.last_raw = None
+        self.last_kept = None
+        self.rejects = 0
+        self.counters = dict.fromkeys(
+            ("received", "kept", "adjusted", "outlier", "stale", "still"), 0
+        )
+        for name in self.counters:
+            metrics.gauge(
+                f"gps_filter_{source}_{name}", lambda name=name: self.counters[name]
+            )
+
+    def process(self, gps: DBGPS) -> DBGPS | None:
+        """Returns the cleaned fix or None if it is dropped."""
+        self.counters["received"] += 1
+        if self.projection is None:
+            self.projection = LocalProjection(gps)
+        position = self.projection.project(gps)[0]
+        moment = gps.created_at.timestamp()
+
+        if self.last_raw is not None:
+            seconds = moment - self.last_raw[1]
+            if seconds <= 0:
+                self.counters["stale"] += 1
+                return None
+            if "outlier" in self.enabled and self.is_outlier(position, moment):
+                self.counters["outlier"] += 1
+                return None
+        self.last_raw = (position, moment)
+
+        adjusted = False
+        if "kalman" in self.enabled:
+            smoothed = self.kalman.update(position, moment)
+            if np.hypot(*(smoothed - position)) > 0.01:
+                adjusted = True
+                (x, y) = self.projection.unproject(*smoothed)
+                gps = DBGPS(x, y, gps.id, gps.created_at)
+            position = smoothed
+
+        if "movement" in self.enabled and self.last_kept is not None:
+            if np.hypot(*(position - self.last_kept)) < self.min_movement:
+                self.counters["still"] += 1
+                return None
+        self.last_kept = position
+        self.counters["kept"] += 1
+        self.counters["adjusted"] += adjusted
+        return gps
+
+    def is_outlier(self, position: np.ndarray, moment: float) -> bool:
+        (last_position, last_moment) = self.last_raw
+        speed = np.hypot(*(position - last_position)) / (moment - last_moment)
+        if speed <= self.max_speed:
+            self.rejects = 0
+            return False
+
+        self.rejects += 1
+        if self.rejects <= self.max_rejects:
+            logging.debug(f"Dropped GPS fix of {self.source} at {speed:.1f} m/s")
+            return True
+        logging.info(f"GPS of {self.source} jumped, starting over")
+        self.rejects = 0
+        self.kalman.reset()
+        self.last_kept = None
+        return False
+
+
+class Kalman:
+    """Constant velocity Kalman filter for east and north positions.
+
+    ``acceleration`` is the standard deviation of the acceleration in m/s²,
+    ``measurement`` the one of a fix in metres.
+    """
+
+    observe = np.array([[1.0, 0, 0, 0], [0, 1.0, 0, 0]])
+
+    def __init__(self, acceleration: float, measurement: float):
+        self.acceleration = acceleration
+        self.noise = np.eye(2) * measurement**2
+        self.reset()
+
+    def reset(self):
+        self.state = None
+        self.covariance = None
+        self.moment = None
+
+    def update(self, position: np.ndarray, moment: float) -> np.ndarray:
+        """Adds a measured position and returns the filtered one."""
+        if self.state is None:
+            self.state = np.array([position[0], position[1], 0.0, 0.0])
+            self.covariance = np.diag([self.noise[0, 0], self.noise[1, 1], 100, 100])
+            self.moment = moment
+            return position
+
+        dt = moment - self.moment
+        self.moment = moment
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+        q = self.acceleration**2
+        process = q * np.array(
+            [
+                [dt**4 / 4, 0, dt**3 / 2, 0],
+                [0, dt**4 / 4, 0, dt**3 / 2],
+                [dt**3 / 2, 0, dt**2, 0],
+                [0, dt**3 / 2, 0, dt**2],
+            ]
+        )
+        state = transition @ self.state
+        covariance = transition @ self.covariance @ transition.T + process
+
+        residual = position - self.observe @ state
+        innovation = self.observe @ covariance @ self.observe.T + self.noise
+        gain = covariance @ self.observe.T @ np.linalg.inv(innovation)
+        self.state = state + gain @ residual
+        self.covariance = (np.eye(4) - gain @ self.observe) @ covariance
+        return self.state[:2].copy()
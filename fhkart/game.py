@@ -1,6 +1,3 @@
-import uuid
-from datetime import datetime
-
 import msgspec
 
 from .gps import GPSBase
@@ -13,7 +10,4 @@ class Game(msgspec.Struct):
     target: list[GPSBase]
 
     def target_as_tuples(self, game_id: int):
-        return [
-            (str(uuid.uuid4()), gps.x, gps.y, datetime.now(), "game", game_id, True)
-            for gps in self.target
-        ]
+        return [(game_id, seq, gps.x, gps.y) for seq, gps in enumerate(self.target)]
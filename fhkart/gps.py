@@ -1,5 +1,8 @@
+import bisect
+import hashlib
 import logging
 import math
+import os
 import random
 import threading
 import time
@@ -8,18 +11,239 @@ import gpxpy
 from datetime import datetime
 
 import msgspec
+import numpy as np
+
+from .helper import get_config_option, local_path
+
+EARTH_RADIUS = 6378137.0
 
 
 def place(point, other_points, target):
-    place = 1
-    distance = point.distance(target)
-    if other_points == []:
-        return place
-    for other in other_points:
-        if other.distance(target) < distance and point.id != other.id:
-            place += 1
+    """Place of a point by distance to the target, 1 is the closest."""
+    others = [other for other in other_points if point.id != other.id]
+    if not others:
+        return 1
+    closer = distances(others, target) < point.distance(target)
+    return int(np.count_nonzero(closer)) + 1
+
+
+def as_radians(points) -> np.ndarray:
+    """Points as an array of latitude and longitude in radians.
+
+    Takes GPSBase points, a single point or an array of degrees.
+    """
+    if isinstance(points, GPSBase):
+        points = [points]
+    if not isinstance(points, np.ndarray):
+        points = [(point.x, point.y) for point in points]
+    return np.radians(np.asarray(points, dtype=np.float64)).reshape(-1, 2)
+
+
+def distances(points, targets) -> np.ndarray:
+    """Haversine distances in metres, like GPSBase.distance.
 
-    return place
+    One target gives one distance per point, ``m`` targets give an ``n`` x
+    ``m`` matrix.
+    """
+    single = isinstance(targets, GPSBase)
+    result = haversine(as_radians(points)[:, None, :], as_radians(targets)[None, :, :])
+    return result[:, 0] if single else result
+
+
+def haversine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Distances in metres between radian arrays that broadcast."""
+    d_lat = b[..., 0] - a[..., 0]
+    d_lon = b[..., 1] - a[..., 1]
+    h = (
+        np.sin(d_lat / 2) ** 2
+        + np.cos(a[..., 0]) * np.cos(b[..., 0]) * np.sin(d_lon / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arctan2(np.sqrt(h), np.sqrt(1 - h))
+
+
+def bearings(points, targets) -> np.ndarray:
+    """Initial bearings in degrees, like GPSBase.bearing, shaped like distances."""
+    single = isinstance(targets, GPSBase)
+    a = as_radians(points)[:, None, :]
+    b = as_radians(targets)[None, :, :]
+    d_lon = b[..., 1] - a[..., 1]
+    y = np.sin(d_lon) * np.cos(b[..., 0])
+    x = np.cos(a[..., 0]) * np.sin(b[..., 0]) - np.sin(a[..., 0]) * np.cos(
+        b[..., 0]
+    ) * np.cos(d_lon)
+    result = np.degrees(np.arctan2(y, x)) % 360
+    return result[:, 0] if single else result
+
+
+def ranks(points, target) -> np.ndarray:
+    """Place of every point by distance to the target, like place.
+
+    Equal distances share a place.
+    """
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.int64)
+    d = distances(points, target)
+    return np.searchsorted(np.sort(d), d, side="left") + 1
+
+
+class LocalProjection:
+    """East and north metres on the plane that touches the earth at ``origin``.
+
+    Exact enough for the few hundred metres of a race track.
+    """
+
+    def __init__(self, origin):
+        (self.lat, self.lon) = as_radians(origin)[0]
+        self.scale = np.array([EARTH_RADIUS * np.cos(self.lat), EARTH_RADIUS])
+
+    def project(self, points) -> np.ndarray:
+        """Points as an array of east and north metres."""
+        radians = as_radians(points)
+        return (radians[:, ::-1] - (self.lon, self.lat)) * self.scale
+
+    def unproject(self, east: float, north: float) -> tuple[float, float]:
+        """Latitude and longitude in degrees of a local point."""
+        (lon, lat) = np.array([east, north]) / self.scale + (self.lon, self.lat)
+        return float(np.degrees(lat)), float(np.degrees(lon))
+
+
+class TrackProgress:
+    """Projects positions onto a track polyline.
+
+    Uses the flattened polyline, segment lengths and their running sum of
+    the compiled track, so a projection is one vectorized pass over the
+    segments. Progress is the distance in metres along the track.
+    """
+
+    def __init__(self, compiled: "CompiledTrack"):
+        if len(compiled.local) < 2:
+            raise ValueError("A track needs at least two points")
+        self.projection = compiled.projection
+        self.starts = compiled.local[:-1]
+        self.vectors = np.diff(compiled.local, axis=0)
+        self.lengths = compiled.lengths
+        self.cumulative = compiled.cumulative
+        self.length = float(self.cumulative[-1])
+        self.squared = np.maximum(self.lengths**2, 1e-12)
+
+    def project(self, gps: "GPSBase") -> float:
+        """Progress of the closest point on the track."""
+        point = self.projection.project(gps)[0]
+        offsets = point - self.starts
+        t = np.clip((offsets * self.vectors).sum(axis=1) / self.squared, 0.0, 1.0)
+        closest = self.starts + t[:, None] * self.vectors
+        distance = np.hypot(*(closest - point).T)
+        segment = int(np.argmin(distance))
+        return float(self.cumulative[segment] + t[segment] * self.lengths[segment])
+
+
+class RaceRanking:
+    """Orders players by laps and progress along the track.
+
+    The order is a sorted list of (-total progress, player id). An update
+    finds the place of the player by binary search and moves only that
+    entry, the list insert and delete are linear but cheap for the few
+    karts of a race. Laps come from a LapTiming per
+    player, the same checkpoint engine that times my own laps. Near the
+    start line the lap and the projected position can disagree for a fix,
+    the sector the timing waits for tells on which side of the line the
+    kart is.
+    """
+
+    def __init__(self, progress: TrackProgress, timing):
+        self.progress = progress
+        self.timing = timing
+        self.lock = threading.Lock()
+        self.order: list[tuple[float, str]] = []
+        self.totals: dict[str, float] = {}
+        self.timings: dict[str, LapTiming] = {}
+        self.last_point: dict[str, datetime] = {}
+
+    def update(self, player_id, gps: "GPSBase") -> int:
+        """Moves a player to its new position and returns its place."""
+        return self.update_points(player_id, [gps])
+
+    def update_points(self, player_id, points: list["GPSBase"]) -> int:
+        """Feeds the points a player got since the last update, newest first.
+
+        Returns the place of the player.
+        """
+        key = str(player_id)
+        with self.lock:
+            last = self.last_point.get(key)
+            total = self.totals.get(key)
+            if last is not None and total is not None:
+                points = [gps for gps in points if gps.created_at > last]
+                if not points:
+                    return bisect.bisect_left(self.order, (-total,)) + 1
+
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = self.timing()
+            for gps in reversed(points):
+                timing.update(gps)
+            newest = points[0]
+            self.last_point[key] = getattr(newest, "created_at", None)
+
+            length = self.progress.length
+            position = self.progress.project(newest)
+            if len(timing.checkpoints) > 2:
+                if timing.next == 1 and position > length / 2:
+                    position -= length
+                elif timing.next == 0 and position < length / 2:
+                    position += length
+
+            self.remove_locked(key)
+            total = (timing.lap - 1) * length + position
+            self.totals[key] = total
+            bisect.insort(self.order, (-total, key))
+            return bisect.bisect_left(self.order, (-total,)) + 1
+
+    def rank(self, player_id) -> int:
+        """Place of a player, 0 if it was never seen.
+
+        Players with the same progress share a place.
+        """
+        key = str(player_id)
+        with self.lock:
+            total = self.totals.get(key)
+            if total is None:
+                return 0
+            return bisect.bisect_left(self.order, (-total,)) + 1
+
+    def lap(self, player_id) -> int:
+        """Lap a player is in, 0 before the start."""
+        timing = self.timings.get(str(player_id))
+        return timing.lap if timing is not None else 0
+
+    def remove(self, player_id):
+        """Takes a player out of the order, its laps are kept for a return."""
+        key = str(player_id)
+        with self.lock:
+            self.remove_locked(key)
+            self.totals.pop(key, None)
+            self.last_point.pop(key, None)
+
+    def retain(self, player_ids):
+        """Removes every player that is not in ``player_ids``."""
+        keep = {str(player_id) for player_id in player_ids}
+        with self.lock:
+            gone = [key for key in self.totals if key not in keep]
+        for key in gone:
+            self.remove(key)
+
+    def remove_locked(self, key: str):
+        total = self.totals.get(key)
+        if total is None:
+            return
+        index = bisect.bisect_left(self.order, (-total, key))
+        if index < len(self.order) and self.order[index] == (-total, key):
+            del self.order[index]
+
+    def players(self) -> list[str]:
+        """Player ids from first to last place."""
+        with self.lock:
+            return [key for _, key in self.order]
 
 
 class GPSBase(msgspec.Struct):
@@ -43,6 +267,17 @@ class GPSBase(msgspec.Struct):
         d = r * c
         return d * 1000
 
+    def bearing(self, gps: "GPSBase"):
+        """Initial bearing towards another point in degrees, 0 is north."""
+        lat1 = self.x * math.pi / 180
+        lat2 = gps.x * math.pi / 180
+        d_lon = gps.y * math.pi / 180 - self.y * math.pi / 180
+        y = math.sin(d_lon) * math.cos(lat2)
+        x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(
+            lat2
+        ) * math.cos(d_lon)
+        return (math.atan2(y, x) * 180 / math.pi) % 360
+
     @classmethod
     def create(self):
         return GPSBase(random.uniform(54.27, 54.35), random.uniform(10.1, 10.2))
@@ -80,53 +315,388 @@ class DBGPS(GPSBase):
         )
 
 
+def cross_product(a: np.ndarray, b: np.ndarray) -> float:
+    return float(a[0] * b[1] - a[1] * b[0])
+
+
+class Gate:
+    """A line across the track at a checkpoint.
+
+    Counts when a move crosses it in driving direction.
+    """
+
+    def __init__(self, center: np.ndarray, direction: np.ndarray, width: float):
+        self.center = center
+        self.direction = direction
+        normal = np.array([-direction[1], direction[0]])
+        self.start = center - normal * width / 2
+        self.line = normal * width
+
+    def crossing(self, a: np.ndarray, b: np.ndarray) -> float | None:
+        """Fraction of the move from ``a`` to ``b`` at the gate, or None."""
+        move = b - a
+        if np.dot(move, self.direction) <= 0:
+            return None
+        denominator = cross_product(move, self.line)
+        if denominator == 0:
+            return None
+        offset = self.start - a
+        t = cross_product(offset, self.line) / denominator
+        u = cross_product(offset, move) / denominator
+        if 0 <= t <= 1 and 0 <= u <= 1:
+            return t
+        return None
+
+
+def closest_fraction(a: np.ndarray, b: np.ndarray, point: np.ndarray) -> float:
+    """Fraction of the move from ``a`` to ``b`` that is closest to ``point``."""
+    move = b - a
+    squared = float(np.dot(move, move))
+    if squared == 0:
+        return 0.0
+    return min(max(float(np.dot(point - a, move)) / squared, 0.0), 1.0)
+
+
+class Geofence:
+    """A circle around a checkpoint, counts when a move comes close enough."""
+
+    def __init__(self, center: np.ndarray, radius: float):
+        self.center = center
+        self.radius = radius
+
+    def crossing(self, a: np.ndarray, b: np.ndarray) -> float | None:
+        """Fraction of the move from ``a`` to ``b`` closest to the center."""
+        t = closest_fraction(a, b, self.center)
+        if np.hypot(*(a + t * (b - a) - self.center)) <= self.radius:
+            return t
+        return None
+
+
+def sector_indices(points: np.ndarray, closed: bool, spacing=None) -> list[int]:
+    """Track points that start a sector, at least ``spacing`` metres apart.
+
+    GPX files have a point every few metres, a kart passes several of them
+    between two fixes. The first point is the start, on an open track the
+    last one is the finish.
+    """
+    spacing = float(spacing or get_config_option("CHECKPOINT_SPACING"))
+    steps = np.hypot(*np.diff(points, axis=0).T)
+    cumulative = np.concatenate(([0.0], np.cumsum(steps)))
+    # A closed track also ends at the start, the last sector must fit in
+    end = cumulative[-1] + (np.hypot(*(points[0] - points[-1])) if closed else 0)
+    indices = [0]
+    for index, distance in enumerate(cumulative):
+        if distance - cumulative[indices[-1]] >= spacing and end - distance >= (
+            spacing / 2 if closed else 0
+        ):
+            indices.append(index)
+    if not closed and indices[-1] != len(points) - 1:
+        indices.append(len(points) - 1)
+    return indices
+
+
+def build_checkpoints(
+    points: np.ndarray, closed: bool, indices: list[int], mode=None
+) -> list:
+    """Gates or geofences at the track points of ``indices``, in local metres.
+
+    CHECKPOINT_MODE picks "gate" or "radius". A gate is perpendicular to
+    the track at its point and CHECKPOINT_GATE_WIDTH wide.
+    """
+    mode = mode or get_config_option("CHECKPOINT_MODE")
+    if mode == "radius":
+        radius = float(get_config_option("CHECKPOINT_RADIUS"))
+        return [Geofence(points[index], radius) for index in indices]
+
+    width = float(get_config_option("CHECKPOINT_GATE_WIDTH"))
+    count = len(points)
+    gates = []
+    for index in indices:
+        if closed:
+            direction = points[(index + 1) % count] - points[index - 1]
+        else:
+            direction = points[min(index + 1, count - 1)] - points[max(index - 1, 0)]
+        length = np.hypot(*direction)
+        if length == 0:
+            direction = np.array([0.0, 1.0])
+        else:
+            direction = direction / length
+        gates.append(Gate(points[index], direction, width))
+    return gates
+
+
+class LapTiming:
+    """Lap and sector times of one kart from checkpoint crossings.
+
+    The move from the fix before is tested against the next checkpoints.
+    After a crossing the rest of the move is tested against the following
+    one, so a long move between two fixes can pass several checkpoints. A
+    checkpoint the kart drove around is skipped when it crosses one of the
+    CHECKPOINT_LOOKAHEAD checkpoints after it. It is timed at the closest
+    approach, its sector time is None and the next sector covers it. A fix
+    costs the same on every track.
+
+    The clock starts when the kart crosses the first checkpoint. On a closed
+    track crossing it again ends the lap, else the last checkpoint is the
+    finish. ``splits`` holds the sector times of every lap and ``laps`` the
+    lap times in seconds.
+    """
+
+    def __init__(self, projection: LocalProjection, checkpoints: list, lap_goal=1):
+        self.projection = projection
+        self.checkpoints = checkpoints
+        self.lap_goal = lap_goal
+        self.finish = 0 if lap_goal > 1 else len(checkpoints) - 1
+        # Looking further than half the track would find checkpoints behind
+        self.lookahead = min(
+            int(get_config_option("CHECKPOINT_LOOKAHEAD")), (len(checkpoints) - 1) // 2
+        )
+
+        self.next = 0
+        self.lap = 0
+        self.finished = False
+        self.previous = None
+        self.lap_started = None
+        self.sector_started = None
+        self.splits: list[list[float | None]] = []
+        self.laps: list[float] = []
+
+    def update(self, gps: "GPSBase") -> bool:
+        """Processes a fix, returns if it crossed a checkpoint."""
+        position = self.projection.project(gps)[0]
+        created_at = getattr(gps, "created_at", None)
+        moment = created_at.timestamp() if created_at else time.time()
+        previous = self.previous
+        self.previous = (position, moment)
+        if previous is None or self.finished:
+            return False
+
+        (start, started) = previous
+        crossed = False
+        for _ in range(len(self.checkpoints)):
+            crossing = self.next_crossing(start, position)
+            if crossing is None:
+                break
+            (skipped, fraction) = crossing
+            for _ in range(skipped):
+                # Timed at the closest approach, the finish may be missed
+                center = self.checkpoints[self.next].center
+                closest = min(closest_fraction(start, position, center), fraction)
+                if not self.finished:
+                    self.cross(started + closest * (moment - started), missed=True)
+            if not self.finished:
+                at = started + fraction * (moment - started)
+                self.cross(at)
+            crossed = True
+            if self.finished:
+                break
+            start = start + fraction * (position - start)
+            started = at
+        return crossed
+
+    def next_crossing(self, a: np.ndarray, b: np.ndarray):
+        """Skipped checkpoints and fraction of the first crossing, or None."""
+        # The start line is never skipped, the clock would start late
+        lookahead = self.lookahead if self.lap > 0 else 0
+        count = len(self.checkpoints)
+        first = None
+        for skipped in range(lookahead + 1):
+            checkpoint = self.checkpoints[(self.next + skipped) % count]
+            fraction = checkpoint.crossing(a, b)
+            if fraction is not None and (first is None or fraction < first[1]):
+                first = (skipped, fraction)
+        return first
+
+    def cross(self, at: float, missed=False):
+        if self.lap == 0:
+            self.start_lap(at)
+        else:
+            if missed:
+                self.splits[-1].append(None)
+            else:
+                self.splits[-1].append(at - self.sector_started)
+                self.sector_started = at
+            if self.next == self.finish:
+                self.laps.append(at - self.lap_started)
+                if len(self.laps) >= self.lap_goal:
+                    self.finished = True
+                    return
+                self.start_lap(at)
+        self.next = (self.next + 1) % len(self.checkpoints)
+
+    def start_lap(self, at: float):
+        self.lap += 1
+        self.lap_started = at
+        self.sector_started = at
+        self.splits.append([])
+
+
+class CompiledTrack(msgspec.Struct, frozen=True):
+    """A parsed GPX file, shared by every Track of the file.
+
+    ``points`` are latitude and longitude in degrees, on a closed track the
+    start is repeated at the end. ``local`` are the same points in metres
+    on the plane of ``projection``, ``lengths`` the length of every segment
+    and ``cumulative`` their running sum. ``sectors`` are the indices of
+    the points with a checkpoint and ``checkpoints`` their gates or
+    geofences. ``bounds`` are the minimum and maximum latitude and
+    longitude. The arrays are read only.
+    """
+
+    digest: str
+    closed: bool
+    points: np.ndarray
+    projection: LocalProjection
+    local: np.ndarray
+    lengths: np.ndarray
+    cumulative: np.ndarray
+    sectors: list[int]
+    checkpoints: list
+    bounds: tuple[float, float, float, float]
+
+    @classmethod
+    def from_points(cls, digest: str, points: np.ndarray, closed: bool):
+        if len(points) == 0:
+            raise ValueError("The track has no points")
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if closed and not np.array_equal(points[0], points[-1]):
+            points = np.vstack((points, points[:1]))
+
+        projection = LocalProjection(points[0])
+        local = projection.project(points)
+        lengths = np.hypot(*np.diff(local, axis=0).T)
+        cumulative = np.concatenate(([0.0], np.cumsum(lengths)))
+        # Checkpoints are built on the points without the repeated start
+        unique = local[:-1] if closed and len(local) > 1 else local
+        sectors = sector_indices(unique, closed)
+        checkpoints = build_checkpoints(unique, closed, sectors)
+        for array in (points, local, lengths, cumulative):
+            array.setflags(write=False)
+
+        (lat_min, lon_min) = points.min(axis=0)
+        (lat_max, lon_max) = points.max(axis=0)
+        return cls(
+            digest,
+            closed,
+            points,
+            projection,
+            local,
+            lengths,
+            cumulative,
+            sectors,
+            checkpoints,
+            (float(lat_min), float(lon_min), float(lat_max), float(lon_max)),
+        )
+
+    def gps_points(self) -> list[GPSBase]:
+        return [GPSBase(float(x), float(y)) for x, y in self.points]
+
+
+def parse_gpx(content: bytes) -> np.ndarray:
+    """Latitude and longitude of every point of a GPX file."""
+    gpx = gpxpy.parse(content.decode())
+    return np.array(
+        [
+            (point.latitude, point.longitude)
+            for track in gpx.tracks
+            for segment in track.segments
+            for point in segment.points
+        ]
+    )
+
+
+class TrackRegistry:
+    """Compiled tracks by file, safe to share between threads.
+
+    A GPX file is parsed and compiled once per content hash. The points are
+    cached as ``<hash>.npz`` in the track cache directory, later starts skip
+    gpxpy.
+    """
+
+    version = 1
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.path.join(local_path, "tracks")
+        self.lock = threading.Lock()
+        self.tracks: dict[tuple[str, bool], CompiledTrack] = {}
+
+    def load(self, filepath: str, closed: bool) -> CompiledTrack:
+        with open(filepath, "rb") as gpx_file:
+            content = gpx_file.read()
+        digest = hashlib.sha256(content).hexdigest()
+
+        with self.lock:
+            compiled = self.tracks.get((digest, closed))
+            if compiled is None:
+                points = self.from_cache(digest)
+                if points is None:
+                    logging.debug(f"Parsing track {filepath}")
+                    points = parse_gpx(content)
+                    self.to_cache(digest, points)
+                compiled = CompiledTrack.from_points(digest, points, closed)
+                self.tracks[(digest, closed)] = compiled
+        return compiled
+
+    def cache_file(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.v{self.version}.npz")
+
+    def from_cache(self, digest: str) -> np.ndarray | None:
+        try:
+            with np.load(self.cache_file(digest)) as cached:
+                return cached["points"]
+        except (OSError, KeyError, ValueError) as e:
+            logging.debug(f"No cached track {digest}: {e}")
+            return None
+
+    def to_cache(self, digest: str, points: np.ndarray):
+        path = self.cache_file(digest)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(f"{path}.tmp", "wb") as cache_file:
+                np.savez(cache_file, points=points)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logging.warning(f"Could not cache track {digest}: {e}")
+
+
+tracks = TrackRegistry()
+
+
 class Track:
     """
     class for handling gpx files and race track progression,
     returns when the player is done
     """
 
-    gps_data: list[GPSBase] = []
-
-    start_pos = None, None
-    current_pos = None, None  # maybe pass this one as arg to the functions?
-    target_pos = None, None
-    current_lap = 1
     lap_goal = 3
-    index = 1
 
     def __init__(self, filepath: str):
-        # try:
-        with open(filepath, "r") as gpx_file:
-            gpx = gpxpy.parse(gpx_file)
-            if gpx_file.read() == None:
-                raise Exception("File is empty")
-
-            for track in gpx.tracks:
-                for segment in track.segments:
-                    for point in segment.points:
-                        self.gps_data.append(GPSBase(point.latitude, point.longitude))
-
-            self.start_pos = self.gps_data[0]
-            self.target_pos = self.gps_data[1]
-
-            if (
-                self.start_pos is not self.gps_data[-1] and self.lap_goal > 1
-            ):  # if last point isnt first point  add it
-                self.gps_data.append(
-                    self.start_pos
-                )  # and more than one lap is required,
-
-            elif (
-                self.start_pos is not self.gps_data[-1] and self.lap_goal == 1
-            ):  # if last point is not first point and only
-                self.start_pos = (self.gps_data[-1],)
-
-                # to ensure check_if_next works
-            # except Exception as e:
+        # On a closed track the start is also the last checkpoint
+        closed = self.lap_goal > 1
+        self.compiled = tracks.load(filepath, closed)
+        self.gps_data: list[GPSBase] = self.compiled.gps_points()
+        self.projection = self.compiled.projection
+        self.sectors = self.compiled.sectors
+
+        self.current_pos = None
+        self.current_lap = 1
+        self.index = 0
+        self.start_pos = self.gps_data[0]
+        self.target_pos = self.start_pos
+        self.timing = self.new_timing()
+        if not closed:
+            self.start_pos = self.gps_data[-1]
+
+    def new_timing(self) -> LapTiming:
+        return LapTiming(self.projection, self.compiled.checkpoints, self.lap_goal)
+
+    def ranking(self) -> RaceRanking:
+        """A new ranking by laps and progress along this track."""
+        return RaceRanking(TrackProgress(self.compiled), self.new_timing)
 
     def update_current_pos(self, gps):
         self.current_pos = gps
+        self.check_if_next_one()
 
     def check_if_next_one(self):
         """
@@ -134,29 +704,22 @@ class Track:
         and updates it automaticially, counts up lap if necessary
         calls win event if the player is done
         """
-        if self.approximate_if_near:
-            if self.target_pos == self.start_pos:
-                self.current_lap += 1
-                self.index = 1
-                if self.current_lap > self.lap_goal:
-                    self.sendWinImpulse()
-            else:
-                self.index += 1
+        if not self.timing.update(self.current_pos):
+            return
 
-            self.target_pos = self.gps_data[self.index]
+        self.current_lap = max(self.timing.lap, 1)
+        self.index = self.sectors[self.timing.next]
+        self.target_pos = self.gps_data[self.index]
+        if self.timing.finished:
+            self.sendWinImpulse()
 
-    def sendWinImpulse():
-        pass  # end game, function call / event?
+    def sendWinImpulse(self):
+        logging.info(f"Finished {self.lap_goal} laps in {sum(self.timing.laps):.1f}s")
 
     def approximate_if_near(self):
-        quotient_lat = abs(1 - abs(self.current_pos.x / self.target_pos.x))
-        quotient_long = abs(1 - abs(self.current_pos.y / self.target_pos.y))
-        if (
-            quotient_lat < 0.0001 and quotient_long < 0.00000000001
-        ):  # less than 0.000000001% inaccuracy, seems fine maybe x10 more
-            return True
-        else:
-            return False
+        """If the current position is within CHECKPOINT_RADIUS of the target."""
+        radius = float(get_config_option("CHECKPOINT_RADIUS"))
+        return self.current_pos.distance(self.target_pos) < radius
 
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@ import logging
 import os
 import sys
 import time
+from datetime import datetime
 
 import folium
 import serial
@@ -10,9 +11,9 @@ from PyQt5.QtCore import QTimer, QUrl
 from PyQt5.QtWebEngineWidgets import QWebEngineSettings, QWebEngineView
 from PyQt5.QtWidgets import QApplication, QHBoxLayout, QLabel, QVBoxLayout, QWidget
 
-from .gps import place
 from .database import Database
 from .helper import local_path
+from .metrics import metrics
 from .player import Player, PlayerPoints
 from .server import KartClient, KartServer
 from .web import WebService
@@ -23,8 +24,9 @@ class PlayerMap(QWidget):
         super().__init__()
 
         self.database = Database(database)
-        self.database.post_init()
+        self.database.post_init(read_only=True)
         self.newest = None
+        self.ranking = self.database.track.ranking()
 
         self.server = KartServer(ip, port, database, args)
 
@@ -125,12 +127,10 @@ class PlayerMap(QWidget):
                         player_group
                     )
 
-            my_place = place(
-                me.points[0],
-                [player.points[0] for player in players if len(player.points) > 0],
-                target[0],
+            (my_place, my_lap) = self.standing(me, players)
+            self.placeField.setText(
+                f"My Place: {my_place} Lap: {max(my_lap, 1)}/{self.database.track.lap_goal}"
             )
-            self.placeField.setText(f"My Place: {my_place}")
 
             trail_coordinates = [me.points[0].as_list(), target[0].as_list()]
             folium.PolyLine(trail_coordinates, tooltip="Target line").add_to(folium_map)
@@ -144,6 +144,33 @@ class PlayerMap(QWidget):
             )
             self.map_view.load(html_map)
 
+            rendered = datetime.now()
+            for player in players:
+                if player.points and isinstance(player.points[0].created_at, datetime):
+                    age = rendered - player.points[0].created_at
+                    metrics.observe("insert_to_render", age.total_seconds() * 1000)
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.server.stop()
+        super().closeEvent(event)
+
+    def standing(self, me, players) -> tuple[int, int]:
+        """My place and lap.
+
+        With a hub they come from its snapshots, else from the local ranking.
+        Place and lap always come from the same source, so they agree.
+        """
+        snapshots = getattr(self.server, "snapshot_thread", None)
+        if snapshots is not None:
+            return snapshots.standings.get(str(me.id), (0, 0))
+
+        ranked = [player for player in players if len(player.points) > 0]
+        self.ranking.retain(player.id for player in ranked)
+        for player in ranked:
+            self.ranking.update_points(player.id, player.points)
+        return self.ranking.rank(me.id), self.ranking.lap(me.id)
+
 
 def start_gui(database, ip, port, args):
     web = WebService()
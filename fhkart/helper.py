@@ -34,5 +34,52 @@ def get_config_option(config_name: str):
         "PORT": 43840,
         "TARGET_HOST": "192.168.100.120",
         "DB_PATH": f"{local_path}/sqlite3.db",
+        "BATCH_POINTS": 5,
+        "RECV_BUFFER": 65507,
+        "RECV_WORKERS": 0,
+        "RECV_BUDGET": 64,
+        "SEQUENCE_WINDOW": 64,
+        "MULTICAST_GROUP": "239.255.43.84",
+        "MULTICAST_PORT": 43841,
+        "MULTICAST_TTL": 1,
+        "MULTICAST_INTERFACE": "",
+        "MULTICAST_INTERVAL": 1.0,
+        "WIRE_FORMAT": "msgpack",
+        "HUB_PORT": 43842,
+        "HUB_INTERVAL": 1.0,
+        "FANOUT_JITTER": 0.5,
+        "FANOUT_DEADLINE": 1.0,
+        "SEND_MIN_INTERVAL": 0.5,
+        "SEND_MAX_INTERVAL": 10.0,
+        "SEND_IDLE_SPEED": 0.5,
+        "SEND_FAST_SPEED": 8.0,
+        "SEND_FAST_TURN": 30.0,
+        "SEND_CHECKPOINT_RADIUS": 5.0,
+        "FILTER_MOCK": "outlier,kalman,movement",
+        "FILTER_SERIAL": "outlier,kalman,movement",
+        "FILTER_MAX_SPEED": 30.0,
+        "FILTER_MAX_REJECTS": 3,
+        "FILTER_PROCESS_NOISE": 1.0,
+        "FILTER_MEASUREMENT_NOISE": 5.0,
+        "FILTER_MIN_MOVEMENT": 1.0,
+        "CHECKPOINT_MODE": "gate",
+        "CHECKPOINT_GATE_WIDTH": 12.0,
+        "CHECKPOINT_RADIUS": 5.0,
+        "CHECKPOINT_SPACING": 20.0,
+        "CHECKPOINT_LOOKAHEAD": 2,
+        "INGEST_FLUSH_INTERVAL": 0.2,
+        "INGEST_BATCH_SIZE": 256,
+        "INGEST_QUEUE_SIZE": 10000,
+        "INGEST_RETRIES": 3,
+        "PLAYER_POINTS": 10,
+        "PLAYER_TIMEOUT": 30.0,
+        "DB_BUSY_TIMEOUT": 5.0,
+        "DB_SYNCHRONOUS": "NORMAL",
+        "DB_WORKERS": 2,
+        "ARCHIVE_PATH": f"{local_path}/archive",
+        "EXPORT_PATH": f"{local_path}/export",
+        "RETENTION_KEEP_GAMES": 3,
+        "RETENTION_ARCHIVE_AFTER": 10,
+        "RETENTION_RESOLUTION": 5.0,
     }
     return os.environ.get(config_name, default_values[config_name])
@@ -1,4 +1,7 @@
 import logging
+import os
+import signal
+import threading
 from argparse import ArgumentParser
 
 from .database import Database, DBInfo
@@ -6,7 +9,9 @@ from .game import Game
 from .gps import GPSBase
 from .gui import start_gui
 from .helper import get_config_option, get_logging_option
-from .server import KartClient, KartServer
+from .retention import Retention
+from .server import HubServer, KartClient, KartServer
+from .web import WebService
 
 
 def main():
@@ -24,14 +29,36 @@ def main():
 
     parser = ArgumentParser(prog="CPSFHKart")
 
-    parser.add_argument("--mode", default="gui", choices=["receive", "send", "gui"])
+    parser.add_argument(
+        "--mode",
+        default="gui",
+        choices=["receive", "send", "gui", "hub", "retention", "export"],
+    )
 
     parser.add_argument(
         "target",
         help="The target ip or hostname the program should try to ping",
         type=str,
+        nargs="?",
+        default=UDP_IP,
     )
     parser.add_argument("--mock", default=False, help="For testing set mock to true")
+    parser.add_argument(
+        "--engine",
+        default="threads",
+        choices=["threads", "asyncio"],
+        help="Run the network services as threads or on one asyncio loop",
+    )
+    parser.add_argument(
+        "--multicast",
+        action="store_true",
+        help="Publish and discover positions in a multicast group",
+    )
+    parser.add_argument(
+        "--hub",
+        action="store_true",
+        help="Send to the hub at target and get the world from it",
+    )
     parser.add_argument(
         "--target-gps-x", default=54.332262, help="The target", type=float
     )
@@ -41,19 +68,72 @@ def main():
 
     parser.add_argument("--track-path", default="./tracks/FHtrack12_125809.gpx")
 
+    parser.add_argument(
+        "--keep-games", help="Retention: newest games kept untouched", type=int
+    )
+    parser.add_argument(
+        "--archive-after",
+        help="Retention: games older than this are archived",
+        type=int,
+    )
+    parser.add_argument(
+        "--resolution", help="Retention: seconds between kept points", type=float
+    )
+
+    parser.add_argument(
+        "--game-id", help="Export: game to export, default is the newest", type=int
+    )
+
     args = parser.parse_args()
 
+    if args.mode == "retention":
+        Retention(db_path, args.keep_games, args.archive_after, args.resolution).run()
+        return
+
+    if args.mode == "export":
+        export_game(db_path, args.game_id)
+        return
+
     (game, track) = Database.for_pre_init(db_path, args)
 
     database = DBInfo(path=db_path, game=game, track=track)
     if args.mode == "receive":
-        KartServer(args.target, UDP_PORT, database, args)
+        # Headless nodes still serve /stats
+        WebService().start()
+        server = KartServer(args.target, UDP_PORT, database, args)
+        wait_for_shutdown()
+        server.stop()
+    elif args.mode == "hub":
+        WebService().start()
+        HubServer(UDP_PORT, database)
     elif args.mode == "send":
         KartClient(args.target, UDP_PORT, database, args)
     elif args.mode == "gui":
         start_gui(database, args.target, UDP_PORT, args)
 
 
+def wait_for_shutdown():
+    """Blocks until Ctrl+C or SIGTERM."""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    logging.info("Shutting down")
+
+
+def export_game(db_path, game_id=None):
+    """Exports the telemetry of a game into EXPORT_PATH."""
+    database = Database.for_maintenance(db_path)
+    if game_id is None:
+        game_id = database.select_game_ids()[0]
+    path = os.path.join(get_config_option("EXPORT_PATH"), f"game_{game_id}")
+    database.export_game(game_id, path)
+    print(path)
+
+
 def start():
     main()
 
@@ -0,0 +1,143 @@
+import threading
+
+
+class Histogram:
+    """Latency histogram with fixed buckets in milliseconds."""
+
+    buckets = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, milliseconds: float):
+        index = 0
+        while index < len(self.buckets) and milliseconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += milliseconds
+
+    def as_dict(self):
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], cumulative)),
+        }
+
+
+class Metrics:
+    """Counters of the network pipeline.
+
+    Packets are counted per peer, stage latencies go into histograms and
+    gauges are read when the metrics are requested. Shared by all threads,
+    use the module level ``metrics``.
+    """
+
+    def __init__(self, max_peers=64):
+        self.lock = threading.Lock()
+        self.peers: dict[str, dict[str, int]] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.peer_histograms: dict[str, dict[str, Histogram]] = {}
+        self.max_peers = max_peers
+        self.gauges = {}
+
+    def count(self, peer: str, name: str, value=1):
+        """Counts packets of a peer.
+
+        Names are sent, send_failed, received, decoded, rejected, duplicate,
+        stale, lost and restarted.
+        """
+        with self.lock:
+            counters = self.peers.setdefault(peer, {})
+            counters[name] = counters.get(name, 0) + value
+
+    def observe(self, stage: str, milliseconds: float, peer: str | None = None):
+        """Adds a latency to the histogram of a stage.
+
+        With a ``peer`` every peer gets its own histogram. Peers beyond
+        ``max_peers`` share the histogram of peer "other".
+        """
+        with self.lock:
+            if peer is None:
+                histograms = self.histograms
+                key = stage
+            else:
+                histograms = self.peer_histograms.setdefault(stage, {})
+                key = peer
+                if key not in histograms and len(histograms) >= self.max_peers:
+                    key = "other"
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = Histogram()
+                histograms[key] = histogram
+            histogram.observe(milliseconds)
+
+    def gauge(self, name: str, function):
+        """Registers a callable that returns the current value of a gauge."""
+        with self.lock:
+            self.gauges[name] = function
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "peers": {
+                    peer: dict(counters) for peer, counters in self.peers.items()
+                },
+                "latency_ms": {
+                    stage: histogram.as_dict()
+                    for stage, histogram in self.histograms.items()
+                },
+                "peer_latency_ms": {
+                    stage: {
+                        peer: histogram.as_dict()
+                        for peer, histogram in histograms.items()
+                    }
+                    for stage, histograms in self.peer_histograms.items()
+                },
+                "gauges": {name: function() for name, function in self.gauges.items()},
+            }
+
+    def prometheus(self) -> str:
+        """Renders the snapshot in the Prometheus text format."""
+        snapshot = self.snapshot()
+        lines = ["# TYPE fhkart_packets_total counter"]
+        for peer, counters in snapshot["peers"].items():
+            for name, value in counters.items():
+                lines.append(
+                    f'fhkart_packets_total{{peer="{peer}",kind="{name}"}} {value}'
+                )
+
+        lines.append("# TYPE fhkart_stage_latency_milliseconds histogram")
+        for stage, histogram in snapshot["latency_ms"].items():
+            lines.extend(self.histogram_lines(f'stage="{stage}"', histogram))
+        for stage, histograms in snapshot["peer_latency_ms"].items():
+            for peer, histogram in histograms.items():
+                lines.extend(
+                    self.histogram_lines(f'stage="{stage}",peer="{peer}"', histogram)
+                )
+
+        lines.append("# TYPE fhkart_gauge gauge")
+        for name, value in snapshot["gauges"].items():
+            lines.append(f'fhkart_gauge{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def histogram_lines(labels: str, histogram: dict) -> list[str]:
+        name = "fhkart_stage_latency_milliseconds"
+        lines = [
+            f'{name}_bucket{{{labels},le="{bucket}"}} {count}'
+            for bucket, count in histogram["buckets"].items()
+        ]
+        lines.append(f'{name}_sum{{{labels}}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{{labels}}} {histogram["count"]}')
+        return lines
+
+
+metrics = Metrics()
@@ -1,14 +1,232 @@
+import struct
+import time
+import uuid
+from datetime import datetime, timedelta
+
 import msgspec
 from .gps import GPSBase, DBGPS
 from .player import Player
 
 
 class Payload(msgspec.Struct):
-    """Payload to be send to servers."""
+    """Payload to be send to servers.
+
+    ``seq`` counts up per sender stream and ``sent_at`` is the unix time of
+    sending, both are 0 for senders that do not set them.
+    """
 
     player: Player
     gps: DBGPS
+    seq: int = 0
+    sent_at: float = 0.0
 
     def __post_init__(self):
         if not self.gps:
             raise ValueError("Gps has to be of type gps")
+
+
+class BatchPayload(msgspec.Struct, array_like=True):
+    """The newest points of a player in one datagram.
+
+    ``first`` is the newest point. Every older point is a delta to the point
+    before: id, micro degrees of x and y and milliseconds. Because every
+    datagram repeats the last points, a lost datagram is filled by the next
+    one. A batch without points is a heartbeat that only announces the
+    player. Encoded as a msgpack array, so receivers can tell it from a
+    Payload map by the first byte.
+    """
+
+    player: Player
+    seq: int
+    first: DBGPS | None = None
+    deltas: list[tuple[uuid.UUID, int, int, int]] = []
+    sent_at: float = 0.0
+
+    @classmethod
+    def from_points(cls, player: Player, seq: int, points: list[DBGPS], sent_at=0.0):
+        """Packs points, newest first."""
+        if not points:
+            return cls(player, seq, sent_at=sent_at)
+        first = points[0]
+        deltas = []
+        previous = (round(first.x * 1e6), round(first.y * 1e6), 0)
+        for gps in points[1:]:
+            current = (
+                round(gps.x * 1e6),
+                round(gps.y * 1e6),
+                round((gps.created_at - first.created_at) / timedelta(milliseconds=1)),
+            )
+            deltas.append(
+                (
+                    gps.id,
+                    current[0] - previous[0],
+                    current[1] - previous[1],
+                    current[2] - previous[2],
+                )
+            )
+            previous = current
+        return cls(player, seq, first, deltas, sent_at)
+
+    def points(self) -> list[DBGPS]:
+        """Unpacks all points, newest first."""
+        first = self.first
+        if first is None:
+            return []
+        points = [first]
+        (x, y, t) = (round(first.x * 1e6), round(first.y * 1e6), 0)
+        for id, dx, dy, dt in self.deltas:
+            x += dx
+            y += dy
+            t += dt
+            points.append(
+                DBGPS(
+                    x / 1e6,
+                    y / 1e6,
+                    id,
+                    first.created_at + timedelta(milliseconds=t),
+                )
+            )
+        return points
+
+
+# Compact frame: version, player id, lat and lon in micro degrees, timestamp in
+# microseconds and sequence number. 0xC1 is never used by msgpack, so the
+# version byte also tells compact frames and msgpack payloads apart.
+COMPACT_VERSION = 0xC1
+compact_frame = struct.Struct("<B16siiqI")
+
+
+def encode_compact(player: Player, seq: int, gps: DBGPS) -> bytes:
+    """Packs the newest point of a player into a 37 byte frame."""
+    created_at = gps.created_at
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    player_id = player.id
+    if not isinstance(player_id, uuid.UUID):
+        player_id = uuid.UUID(player_id)
+    return compact_frame.pack(
+        COMPACT_VERSION,
+        player_id.bytes,
+        round(gps.x * 1e6),
+        round(gps.y * 1e6),
+        round(created_at.timestamp() * 1e6),
+        seq & 0xFFFFFFFF,
+    )
+
+
+def decode_compact(message: bytes) -> Payload:
+    """Unpacks a compact frame.
+
+    The frame has no point id. It is built from player and timestamp, so
+    repeated frames are still recognized as duplicates.
+    """
+    try:
+        (version, player_id, x, y, timestamp, seq) = compact_frame.unpack(message)
+    except struct.error as e:
+        raise ValueError(f"Invalid compact frame: {e}")
+    if version != COMPACT_VERSION:
+        raise ValueError(f"Unknown compact frame version {version}")
+
+    return Payload(
+        Player(uuid.UUID(bytes=player_id), ""),
+        seq=seq,
+        gps=DBGPS(
+            x / 1e6,
+            y / 1e6,
+            point_id(player_id, timestamp),
+            datetime.fromtimestamp(timestamp / 1e6),
+        ),
+    )
+
+
+def point_id(player_id: bytes, timestamp: int) -> uuid.UUID:
+    """Point id for frames that do not carry one."""
+    return uuid.UUID(bytes=player_id[:8] + timestamp.to_bytes(8, "little", signed=True))
+
+
+class SnapshotEntry(msgspec.Struct, array_like=True):
+    """Newest point, rank and lap of one player in a WorldSnapshot.
+
+    Coordinates are micro degrees, the timestamp is in microseconds. The lap
+    is 0 if the hub does not know the track.
+    """
+
+    player_id: uuid.UUID
+    x: int
+    y: int
+    timestamp: int
+    rank: int
+    lap: int = 0
+
+    @classmethod
+    def from_point(cls, player_id: uuid.UUID, gps: DBGPS, rank: int, lap=0):
+        created_at = gps.created_at
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        return cls(
+            player_id,
+            round(gps.x * 1e6),
+            round(gps.y * 1e6),
+            round(created_at.timestamp() * 1e6),
+            rank,
+            lap,
+        )
+
+    def gps(self) -> DBGPS:
+        return DBGPS(
+            self.x / 1e6,
+            self.y / 1e6,
+            point_id(self.player_id.bytes, self.timestamp),
+            datetime.fromtimestamp(self.timestamp / 1e6),
+        )
+
+
+class WorldSnapshot(msgspec.Struct, array_like=True):
+    """State of all players, sent by the hub to its subscribers once per tick.
+
+    Only sent on the HUB_PORT, so it needs no dispatch with the payloads.
+    """
+
+    seq: int
+    sent_at: float
+    players: list[SnapshotEntry] = []
+
+    def payloads(self, address: str) -> list[Payload]:
+        """One payload per player, as if ``address`` had sent it."""
+        return [
+            Payload(
+                Player(entry.player_id, address), entry.gps(), self.seq, self.sent_at
+            )
+            for entry in self.players
+        ]
+
+
+def encode_points(player: Player, seq: int, points: list[DBGPS], wire_format: str):
+    """Packs the newest points of a player in the configured wire format.
+
+    "msgpack" sends a BatchPayload, "compact" only the newest point as a
+    compact frame. Without points a heartbeat batch is sent.
+    """
+    if wire_format == "compact" and points:
+        return encode_compact(player, seq, points[0])
+    return msgspec.msgpack.encode(
+        BatchPayload.from_points(player, seq, points, time.time())
+    )
+
+
+payload_decoder = msgspec.msgpack.Decoder(Payload)
+batch_decoder = msgspec.msgpack.Decoder(BatchPayload)
+snapshot_decoder = msgspec.msgpack.Decoder(WorldSnapshot)
+
+
+def decode_message(message: bytes) -> Payload | BatchPayload:
+    """Decodes any payload a peer can send.
+
+    A Payload is a msgpack map, a BatchPayload a msgpack array and a compact
+    frame starts with its version byte.
+    """
+    if message and message[0] == COMPACT_VERSION:
+        return decode_compact(message)
+    if message and (message[0] & 0xF0 == 0x90 or message[0] in (0xDC, 0xDD)):
+        return batch_decoder.decode(message)
+    return payload_decoder.decode(message)
@@ -1,8 +1,11 @@
+import threading
+import time
 import uuid
 
 import msgspec
 
 from .gps import DBGPS
+from .helper import get_config_option
 
 
 class Player(msgspec.Struct):
@@ -22,3 +25,65 @@ class Player(msgspec.Struct):
 
 class PlayerPoints(Player, kw_only=True):
     points: list[DBGPS]
+
+
+class PlayerRegistry:
+    """All players this node has seen, keyed by id.
+
+    Shared by every thread. ``observe`` is called for every received packet and
+    tells the caller if the player is new or changed, so the database only has
+    to be written then. Players that were not seen for ``timeout`` seconds
+    are handed out once by ``expire``.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = float(timeout or get_config_option("PLAYER_TIMEOUT"))
+        self.lock = threading.Lock()
+        self.players: dict[str, Player] = {}
+        self.last_seen: dict[str, float] = {}
+
+    def add(self, player: Player):
+        with self.lock:
+            self.players[str(player.id)] = player
+            self.last_seen[str(player.id)] = time.monotonic()
+
+    def get(self, id) -> Player | None:
+        return self.players.get(str(id))
+
+    def observe(self, player: Player) -> tuple[Player, str | None]:
+        """Registers a packet of a player.
+
+        Returns the known player and what changed: "new", "active", "address"
+        or None.
+        """
+        key = str(player.id)
+        with self.lock:
+            self.last_seen[key] = time.monotonic()
+            known = self.players.get(key)
+            if known is None:
+                known = Player(player.id, player.address)
+                self.players[key] = known
+                return known, "new"
+            if not known.active:
+                known.active = True
+                known.address = player.address
+                return known, "active"
+            if known.address != player.address and not known.me:
+                known.address = player.address
+                return known, "address"
+            return known, None
+
+    def expire(self) -> list[Player]:
+        """Deactivates and returns players that timed out."""
+        deadline = time.monotonic() - self.timeout
+        expired = []
+        with self.lock:
+            for key, player in self.players.items():
+                if player.active and not player.me and self.last_seen[key] < deadline:
+                    player.active = False
+                    expired.append(player)
+        return expired
+
+    def active(self) -> list[Player]:
+        with self.lock:
+            return [player for player in self.players.values() if player.active]
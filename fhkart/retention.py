@@ -0,0 +1,148 @@
+import gzip
+import logging
+import os
+from datetime import datetime
+
+import msgspec
+
+from .database import Database
+from .game import Game
+from .gps import DBGPS
+from .helper import get_config_option
+
+
+class ArchivedPlayer(msgspec.Struct):
+    id: str
+    points: list[DBGPS]
+
+
+class GameArchive(msgspec.Struct):
+    """A finished game with all points, as it is stored in the archive."""
+
+    game: Game
+    players: list[ArchivedPlayer]
+
+
+def parse_timestamp(created_at) -> datetime:
+    """Sqlite gives timestamps back as iso strings."""
+    if isinstance(created_at, str):
+        return datetime.fromisoformat(created_at)
+    return created_at
+
+
+def downsample(points: list[DBGPS], resolution: float) -> list[DBGPS]:
+    """Returns the points that are closer than ``resolution`` seconds to the
+    last kept point.
+
+    Points have to be ordered by time. The first point is always kept.
+    """
+    dropped = []
+    last_kept = None
+    for gps in points:
+        created_at = parse_timestamp(gps.created_at)
+        if (
+            last_kept is not None
+            and (created_at - last_kept).total_seconds() < resolution
+        ):
+            dropped.append(gps)
+        else:
+            last_kept = created_at
+    return dropped
+
+
+def group_by_player(rows: list[tuple[str, DBGPS]]) -> dict[str, list[DBGPS]]:
+    players: dict[str, list[DBGPS]] = {}
+    for player_id, gps in rows:
+        players.setdefault(player_id, []).append(gps)
+    return players
+
+
+def archive_file(archive_path: str, game_id: int) -> str:
+    return os.path.join(archive_path, f"game_{game_id}.msgpack.gz")
+
+
+def load_archive(path: str) -> GameArchive:
+    """Loads an archived game."""
+    with gzip.open(path, "rb") as archive:
+        return msgspec.msgpack.decode(archive.read(), type=GameArchive)
+
+
+class Retention:
+    """Keeps the live database small.
+
+    The newest ``keep_games`` games stay untouched. Older games are
+    downsampled to one point per ``resolution`` seconds and player. Games older
+    than ``archive_after`` are moved into a gzip compressed msgpack file per
+    game and deleted from the database. At the end the database is vacuumed.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        keep_games=None,
+        archive_after=None,
+        resolution=None,
+        archive_path=None,
+    ):
+        self.database = Database.for_maintenance(db_path)
+        if keep_games is None:
+            keep_games = get_config_option("RETENTION_KEEP_GAMES")
+        if archive_after is None:
+            archive_after = get_config_option("RETENTION_ARCHIVE_AFTER")
+        if resolution is None:
+            resolution = get_config_option("RETENTION_RESOLUTION")
+        self.keep_games = int(keep_games)
+        self.archive_after = int(archive_after)
+        self.resolution = float(resolution)
+        self.archive_path = archive_path or get_config_option("ARCHIVE_PATH")
+
+    def run(self):
+        game_ids = self.database.select_game_ids()
+
+        for game_id in game_ids[self.keep_games : self.archive_after]:
+            self.downsample_game(game_id)
+
+        for game_id in game_ids[max(self.archive_after, self.keep_games) :]:
+            self.archive_game(game_id)
+
+        self.database.vacuum()
+        logging.info("Vacuumed database")
+
+    def downsample_game(self, game_id):
+        players = group_by_player(self.database.select_game_points(game_id))
+        dropped = []
+        for points in players.values():
+            dropped += downsample(points, self.resolution)
+
+        if dropped:
+            self.database.delete_points([gps.id for gps in dropped])
+            self.database.commit()
+            logging.info(f"Downsampled game {game_id}, dropped {len(dropped)} points")
+
+    def archive_game(self, game_id) -> str:
+        """Writes a game into the archive and deletes it from the database."""
+        game = self.database.select_game(game_id)
+        players = group_by_player(self.database.select_game_points(game_id))
+        archive = GameArchive(
+            game,
+            [
+                ArchivedPlayer(
+                    player_id,
+                    [
+                        DBGPS(gps.x, gps.y, gps.id, parse_timestamp(gps.created_at))
+                        for gps in points
+                    ],
+                )
+                for player_id, points in players.items()
+            ],
+        )
+
+        os.makedirs(self.archive_path, exist_ok=True)
+        path = archive_file(self.archive_path, game_id)
+        with gzip.open(path, "wb") as handle:
+            handle.write(msgspec.msgpack.encode(archive))
+
+        self.database.delete_game(game_id)
+        self.database.commit()
+        logging.info(f"Archived game {game_id} to {path}")
+        return path
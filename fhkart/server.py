@@ -1,43 +1,274 @@
+import asyncio
+import itertools
 import logging
+import random
 import socket
 import threading
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+
 import serial
 import msgspec
+import numpy as np
+
+from .database import Database, DBInfo, DBWrapper, IngestWriter
+from .filter import GPSFilter
+from .gps import DBGPS, GPSBase, ranks
+from .helper import get_config_option, get_ip_address, my_ip, sleep_time
+from .metrics import metrics
+from .payload import (
+    SnapshotEntry,
+    WorldSnapshot,
+    decode_message,
+    encode_points,
+    snapshot_decoder,
+)
+
 
-from .database import Database, DBInfo, DBWrapper
-from .gps import DBGPS, GPSBase
-from .helper import get_ip_address, my_ip, sleep_time
-from .payload import Payload
+wire_format = get_config_option("WIRE_FORMAT")
 
 
-def ping(sock, ip: str, port: int, gps: DBGPS, database):
-    """Sends a payload to a socket."""
+def ping_batch(sock, ip: str, port: int, points: list[DBGPS], database, sequence):
+    """Sends the newest points of this player in one datagram.
+
+    Uses the WIRE_FORMAT, receivers understand all formats. ``sequence`` is
+    the counter of the sending socket.
+    """
     try:
-        payload = Payload(database.me, gps)
-        # database.insert_payload(payload)
-        packed = msgspec.msgpack.encode(payload)
+        packed = encode_points(database.me, next(sequence), points, wire_format)
         sock.sendto(packed, (ip, port))
-        logging.debug(f"Send new point {gps} to {ip}:{port}")
-        return payload
-    except ValueError:
-        pass
+        metrics.count(ip, "sent")
+        logging.debug(f"Send {len(points)} points to {ip}:{port}")
+        return packed
+    except (ValueError, IndexError):
+        metrics.count(ip, "send_failed")
+
+
+class SequenceWindow:
+    """Drops duplicate and stale datagrams before they reach the database.
+
+    Every sending socket of a player is its own stream with its own sequence
+    numbers. Per stream the newest sequence number and the numbers seen in
+    the last ``size`` are kept. Anything not newer than the newest is
+    dropped, older points are repeated by the next batch anyway. Streams
+    count from 1, so a 1 or a number far below the window means the sender
+    restarted, even if it restarted within the window. Loss, reordering and
+    one-way latency go into the metrics of the peer, the latency needs
+    synchronized clocks.
+    """
+
+    def __init__(self, size=None):
+        self.size = int(size or get_config_option("SEQUENCE_WINDOW"))
+        self.lock = threading.Lock()
+        self.newest: dict[tuple[str, tuple], int] = {}
+        self.seen: dict[tuple[str, tuple], set[int]] = {}
+
+    def accept(self, payload, address) -> bool:
+        peer = address[0]
+        if payload.sent_at:
+            metrics.observe(
+                "one_way_latency", (time.time() - payload.sent_at) * 1000, peer
+            )
+        if not payload.seq:
+            return True
+
+        seq = payload.seq
+        stream = (str(payload.player.id), address)
+        with self.lock:
+            newest = self.newest.get(stream)
+            if newest is None or seq == 1 or seq <= newest - self.size:
+                if newest is not None:
+                    metrics.count(peer, "restarted")
+                self.newest[stream] = seq
+                self.seen[stream] = {seq}
+                return True
+
+            seen = self.seen[stream]
+            if seq in seen:
+                metrics.count(peer, "duplicate")
+                return False
+            seen.add(seq)
+
+            if seq < newest:
+                # It was counted as lost when a newer one came in
+                metrics.count(peer, "lost", -1)
+                metrics.count(peer, "stale")
+                return False
+
+            if seq > newest + 1:
+                metrics.count(peer, "lost", seq - newest - 1)
+            self.newest[stream] = seq
+            self.seen[stream] = {number for number in seen if number > seq - self.size}
+            return True
+
+
+class FanOut:
+    """Sends my newest points to all peers once per tick.
+
+    Keeps one socket and encodes the points once per tick, then sends to
+    every peer back to back. Peers that are not reached before the deadline
+    wait for the next tick. Ticks get a random jitter, so the nodes do not
+    all send at the same moment.
+    """
+
+    def __init__(self, port: int, sock=None, interval=sleep_time):
+        self.port = int(port)
+        self.sock = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.interval = interval
+        self.jitter = float(get_config_option("FANOUT_JITTER"))
+        self.deadline = float(get_config_option("FANOUT_DEADLINE"))
+        self.sequence = itertools.count(1)
+
+    def send(self, players, points: list[DBGPS], database) -> int:
+        """Sends the points to every player that is not me.
+
+        Returns the number of players that were sent to.
+        """
+        if not points:
+            return 0
+        try:
+            packed = encode_points(
+                database.me, next(self.sequence), points, wire_format
+            )
+        except ValueError:
+            return 0
+
+        deadline = time.monotonic() + self.deadline
+        sent = 0
+        for player in players:
+            if player.me:
+                continue
+            if time.monotonic() > deadline:
+                logging.warning(f"Fan out deadline hit after {sent} players")
+                break
+            try:
+                self.sock.sendto(packed, (player.address, self.port))
+                metrics.count(player.address, "sent")
+                sent += 1
+            except OSError as e:
+                metrics.count(player.address, "send_failed")
+                logging.debug(f"Could not send to player {player.id}: {e}")
+        logging.debug(f"Sent {len(points)} points to {sent} players")
+        return sent
+
+    def next_delay(self) -> float:
+        """Time until the next tick."""
+        return max(0.0, self.interval + random.uniform(-self.jitter, self.jitter))
+
+
+class AdaptiveRate:
+    """Decides when the newest point is worth sending.
+
+    A point is never sent twice, except as heartbeat after ``max_interval``.
+    The send interval shrinks from ``max_interval`` towards ``min_interval``
+    the faster the kart drives or turns, and a moving kart near a timing
+    checkpoint of the track always sends at ``min_interval``. A kart that
+    stands still only sends the heartbeat.
+    """
+
+    def __init__(self, track=None):
+        self.track = track
+        self.min_interval = float(get_config_option("SEND_MIN_INTERVAL"))
+        self.max_interval = float(get_config_option("SEND_MAX_INTERVAL"))
+        self.idle_speed = float(get_config_option("SEND_IDLE_SPEED"))
+        self.fast_speed = float(get_config_option("SEND_FAST_SPEED"))
+        self.fast_turn = float(get_config_option("SEND_FAST_TURN"))
+        self.checkpoint_radius = float(get_config_option("SEND_CHECKPOINT_RADIUS"))
+        self.checkpoints = None
+        if track is not None:
+            self.checkpoints = np.array(
+                [checkpoint.center for checkpoint in track.compiled.checkpoints]
+            )
+
+        self.last_sent = None
+        self.last_sent_at = 0.0
+        self.sent = 0
+        self.heartbeats = 0
+        self.suppressed = 0
+        metrics.gauge("sender_sent", lambda: self.sent)
+        metrics.gauge("sender_heartbeats", lambda: self.heartbeats)
+        metrics.gauge("sender_suppressed", lambda: self.suppressed)
+
+    def interval(self, points: list[DBGPS]) -> float:
+        """Send interval for the newest points, newest first."""
+        if len(points) < 2:
+            return self.max_interval
+
+        speed = self.speed(points[1], points[0])
+        if speed < self.idle_speed:
+            return self.max_interval
+        if self.near_checkpoint(points[0]):
+            return self.min_interval
+
+        activity = speed / self.fast_speed
+        if len(points) > 2:
+            seconds = (points[0].created_at - points[2].created_at).total_seconds()
+            turn = abs(
+                (points[1].bearing(points[0]) - points[2].bearing(points[1]) + 180)
+                % 360
+                - 180
+            )
+            if seconds > 0:
+                activity = max(activity, turn / seconds / self.fast_turn)
+
+        activity = min(activity, 1.0)
+        return self.max_interval - activity * (self.max_interval - self.min_interval)
+
+    def speed(self, older: DBGPS, newer: DBGPS) -> float:
+        """Speed between two points in m/s."""
+        seconds = (newer.created_at - older.created_at).total_seconds()
+        if seconds <= 0:
+            return 0.0
+        return older.distance(newer) / seconds
+
+    def near_checkpoint(self, gps: DBGPS) -> bool:
+        """If the kart is close to one of the timing checkpoints of the track."""
+        if self.checkpoints is None:
+            return False
+        position = self.track.projection.project(gps)[0]
+        distances = np.hypot(*(self.checkpoints - position).T)
+        return bool((distances < self.checkpoint_radius).any())
+
+    def should_send(self, points: list[DBGPS]) -> bool:
+        """Returns if the points should be sent now and counts the decision."""
+        if not points:
+            return False
+
+        now = time.monotonic()
+        since_last = now - self.last_sent_at
+        if self.last_sent is not None and points[0].id == self.last_sent.id:
+            if since_last < self.max_interval:
+                self.suppressed += 1
+                return False
+            self.heartbeats += 1
+        elif since_last < self.interval(points):
+            self.suppressed += 1
+            return False
+        else:
+            self.sent += 1
+
+        self.last_sent = points[0]
+        self.last_sent_at = now
+        return True
 
 
 class GPSMockService(threading.Thread, DBWrapper):
     def __init__(self, database):
         DBWrapper.__init__(self, database)
+        self.filter = GPSFilter("mock")
 
         threading.Thread.__init__(self)
 
     def run(self):
         self.database.post_init()
         while not self.exit:
-            gps = DBGPS.create()
-            logging.debug(f"Inserted new Point {gps}")
-            self.database.insert_gps(gps, self.database.me)
-            self.database.commit()
+            gps = self.filter.process(DBGPS.create())
+            if gps is not None:
+                logging.debug(f"Inserted new Point {gps}")
+                self.database.queue_gps(gps, self.database.me)
+                self.database.track.update_current_pos(gps)
             time.sleep(sleep_time)
 
 
@@ -46,6 +277,7 @@ class GPSService(threading.Thread, DBWrapper):
         DBWrapper.__init__(self, database)
         self.serial_port = "/dev/ttyUSB3"
         self.baud_rate = 115200
+        self.filter = GPSFilter("serial")
 
         threading.Thread.__init__(self)
 
@@ -63,10 +295,12 @@ class GPSService(threading.Thread, DBWrapper):
                     response = ser.read(bytesToRead).decode().strip()
                     if len(response) > 0:
                         (x, y) = self.parse_INF_string(response)
-                        gps = DBGPS.from_parser(x, y)
+                        gps = self.filter.process(DBGPS.from_parser(x, y))
+                        if gps is None:
+                            continue
                         logging.debug(f"Inserted new Point {gps}")
-                        self.database.insert_gps(gps, self.database.me)
-                        self.database.commit()
+                        self.database.queue_gps(gps, self.database.me)
+                        self.database.track.update_current_pos(gps)
 
             except:
                 continue
@@ -147,25 +381,15 @@ class PingBackService(threading.Thread, DBWrapper):
         threading.Thread.__init__(self)
 
     def run(self):
-        self.database.post_init()
+        self.database.post_init(read_only=True)
+        batch_points = int(get_config_option("BATCH_POINTS"))
+        fan_out = FanOut(self.port)
         while not self.exit:
-            gps = self.database.select_my_newest_point()
+            points = self.database.select_my_newest_points(batch_points)
             players = self.database.select_active_players()
 
-            self.send_players(players, self.port, gps, self.database)
-            time.sleep(sleep_time)
-
-    def send_players(self, players, port, gps, database):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
-
-        for player in players:
-            if not player.me:
-                if player.address not in ["localhost", "127.0.0.1", my_ip]:
-                    logging.debug(f"Sending to player {str(player.id)}")
-                    ping(sock, player.address, port, gps, database)
-                else:
-                    ping(sock, player.address, port, gps, database)
-            time.sleep(sleep_time)
+            fan_out.send(players, points, self.database)
+            time.sleep(fan_out.next_delay())
 
 
 class SenderService(threading.Thread, DBWrapper):
@@ -179,16 +403,44 @@ class SenderService(threading.Thread, DBWrapper):
     def run(self):
         """Sending Thread function.
 
-        Sends packets to a server and sleeps for a while
+        Sends packets to a server whenever the adaptive rate allows it
         """
-        self.database.post_init()
+        self.database.post_init(read_only=True)
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
         logging.debug("Sender started")
+        batch_points = int(get_config_option("BATCH_POINTS"))
+        self.rate = AdaptiveRate(self.database.track)
+        sequence = itertools.count(1)
         while not self.exit:
-            gps = self.database.select_my_newest_point()
-            ping(sock, self.ip, self.port, gps, self.database)
+            points = self.database.select_my_newest_points(batch_points)
+            if self.rate.should_send(points):
+                ping_batch(sock, self.ip, self.port, points, self.database, sequence)
 
-            time.sleep(sleep_time)
+            time.sleep(self.rate.min_interval)
+
+
+sequence_window = SequenceWindow()
+
+
+def decode_datagram(message: bytes, address):
+    """Decodes a datagram for every receiver.
+
+    Invalid, duplicate and stale datagrams are counted and dropped.
+    """
+    metrics.count(address[0], "received")
+    try:
+        payload = decode_message(message)
+    except (msgspec.DecodeError, ValueError) as e:
+        metrics.count(address[0], "rejected")
+        logging.debug(f"Dropped invalid packet from {address[0]}: {e}")
+        return None
+
+    metrics.count(address[0], "decoded")
+    if not sequence_window.accept(payload, address):
+        return None
+    payload.player.address = address[0]
+    logging.debug(f"Received new payload {payload}")
+    return payload
 
 
 class ReceiverService(threading.Thread, DBWrapper):
@@ -196,6 +448,7 @@ class ReceiverService(threading.Thread, DBWrapper):
         DBWrapper.__init__(self, database)
         self.ip = ip
         self.port = port
+        self.recv_buffer = int(get_config_option("RECV_BUFFER"))
 
         threading.Thread.__init__(self)
 
@@ -207,43 +460,559 @@ class ReceiverService(threading.Thread, DBWrapper):
 
         while not self.exit:
             # Receive the client packet along with the address it is coming from
-            message, address = sock.recvfrom(1024)
+            message, address = sock.recvfrom(self.recv_buffer)
+            received = time.monotonic()
+
+            payload = decode_datagram(message, address)
+            if payload is not None:
+                self.database.insert_payload(payload)
+                metrics.observe(
+                    "receive_to_insert", (time.monotonic() - received) * 1000
+                )
+
+
+class BatchReceiverService(ReceiverService):
+    """Receiver for nodes that get packets from every kart at once.
+
+    Waits for one datagram, then drains the socket without blocking up to
+    RECV_BUDGET datagrams. The whole batch is decoded and handed to the
+    database in one call. With ``reuse_port`` several workers can share the
+    port, the kernel spreads the peers over them.
+    """
+
+    def __init__(self, database, ip: str, port: int, reuse_port=False):
+        ReceiverService.__init__(self, database, ip, port)
+        self.reuse_port = reuse_port
+        self.budget = int(get_config_option("RECV_BUDGET"))
+
+    def run(self):
+        self.database.post_init()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.ip, self.port))
+        logging.debug("Batch receiver started")
+
+        while not self.exit:
+            datagrams = [sock.recvfrom(self.recv_buffer)]
+            while len(datagrams) < self.budget:
+                try:
+                    datagrams.append(
+                        sock.recvfrom(self.recv_buffer, socket.MSG_DONTWAIT)
+                    )
+                except BlockingIOError:
+                    break
+
+            received = time.monotonic()
+            payloads = [
+                decode_datagram(message, address) for message, address in datagrams
+            ]
+            self.database.insert_payloads(
+                [payload for payload in payloads if payload is not None]
+            )
+            metrics.observe("receive_to_insert", (time.monotonic() - received) * 1000)
+
 
-            payload = msgspec.msgpack.decode(message, type=Payload)
-            payload.player.address = address[0]
-            self.database.insert_payload(payload)
+class MulticastService(ReceiverService):
+    """Group mode without a central target.
 
-            logging.debug(f"Received new point {payload.gps}")
+    Every kart joins the MULTICAST_GROUP and publishes its newest points once
+    per MULTICAST_INTERVAL, all peers get the same datagram. Receiving a
+    datagram registers the sender, karts without a fix yet send an empty
+    batch as heartbeat. Own datagrams come back over the loop and are ignored
+    like every packet of me.
+    """
+
+    def __init__(self, database):
+        ReceiverService.__init__(
+            self,
+            database,
+            get_config_option("MULTICAST_GROUP"),
+            int(get_config_option("MULTICAST_PORT")),
+        )
+        self.ttl = int(get_config_option("MULTICAST_TTL"))
+        self.interface = get_config_option("MULTICAST_INTERFACE")
+        self.interval = float(get_config_option("MULTICAST_INTERVAL"))
+
+    def open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", self.port))
+
+        interface = socket.inet_aton(self.interface or "0.0.0.0")
+        membership = socket.inet_aton(self.ip) + interface
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        if self.interface:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+        return sock
+
+    def run(self):
+        self.database.post_init()
+        sock = self.open_socket()
+        batch_points = int(get_config_option("BATCH_POINTS"))
+        self.sequence = itertools.count(1)
+        logging.debug(f"Joined multicast group {self.ip}:{self.port}")
+
+        next_tick = time.monotonic()
+        while not self.exit:
+            timeout = next_tick - time.monotonic()
+            if timeout <= 0:
+                self.publish(sock, batch_points)
+                next_tick = time.monotonic() + self.interval
+                continue
+
+            sock.settimeout(timeout)
+            try:
+                message, address = sock.recvfrom(self.recv_buffer)
+            except socket.timeout:
+                continue
+            received = time.monotonic()
+
+            payload = decode_datagram(message, address)
+            if payload is not None:
+                self.database.insert_payload(payload)
+                metrics.observe(
+                    "receive_to_insert", (time.monotonic() - received) * 1000
+                )
+
+    def publish(self, sock, batch_points):
+        """Sends my newest points to the group."""
+        points = self.database.select_my_newest_points(batch_points)
+        packed = encode_points(
+            self.database.me, next(self.sequence), points, wire_format
+        )
+        try:
+            sock.sendto(packed, (self.ip, self.port))
+            metrics.count(self.ip, "sent")
+        except OSError as e:
+            metrics.count(self.ip, "send_failed")
+            logging.debug(f"Could not publish to multicast group: {e}")
+
+
+class HubService(threading.Thread, DBWrapper):
+    """Sends the world state of the hub to its subscribers.
+
+    Karts and spectator screens subscribe by sending any datagram to the
+    HUB_PORT and repeat it before PLAYER_TIMEOUT runs out. Once per
+    HUB_INTERVAL every subscriber gets the same WorldSnapshot with the newest
+    point and rank of every active player.
+    """
+
+    def __init__(self, database, port=None):
+        DBWrapper.__init__(self, database)
+        self.port = int(port or get_config_option("HUB_PORT"))
+        self.interval = float(get_config_option("HUB_INTERVAL"))
+        self.timeout = float(get_config_option("PLAYER_TIMEOUT"))
+        self.recv_buffer = int(get_config_option("RECV_BUFFER"))
+        self.subscribers: dict[tuple, float] = {}
+        self.sequence = itertools.count(1)
+        metrics.gauge("hub_subscribers", lambda: len(self.subscribers))
+
+        threading.Thread.__init__(self)
+
+    def run(self):
+        self.database.post_init(read_only=True)
+        track = self.database.track
+        self.ranking = track.ranking() if track is not None else None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("", self.port))
+        logging.debug(f"Hub publishes on port {self.port}")
+
+        next_tick = time.monotonic()
+        while not self.exit:
+            timeout = next_tick - time.monotonic()
+            if timeout <= 0:
+                self.publish(sock)
+                next_tick = time.monotonic() + self.interval
+                continue
+
+            sock.settimeout(timeout)
+            try:
+                _, address = sock.recvfrom(self.recv_buffer)
+            except socket.timeout:
+                continue
+            if address not in self.subscribers:
+                logging.info(f"New subscriber {address[0]}:{address[1]}")
+            self.subscribers[address] = time.monotonic()
+
+    def snapshot(self) -> WorldSnapshot:
+        players = [
+            player
+            for player in self.database.select_active_players()
+            if player.points and not player.me
+        ]
+        standings = self.standings(players)
+        entries = [
+            SnapshotEntry.from_point(player.id, player.points[0], rank, lap)
+            for player, (rank, lap) in zip(players, standings)
+        ]
+        return WorldSnapshot(next(self.sequence), time.time(), entries)
+
+    def standings(self, players) -> list[tuple[int, int]]:
+        """Place and lap of every player.
+
+        By laps and progress along the track, without a track by distance
+        to the target and without laps.
+        """
+        if self.ranking is not None:
+            self.ranking.retain(player.id for player in players)
+            for player in players:
+                self.ranking.update_points(player.id, player.points)
+            return [
+                (self.ranking.rank(player.id), self.ranking.lap(player.id))
+                for player in players
+            ]
+
+        target = self.database.game.target
+        if not target:
+            return [(0, 0)] * len(players)
+        places = ranks([player.points[0] for player in players], target[0])
+        return [(int(place), 0) for place in places]
+
+    def publish(self, sock):
+        """Sends one snapshot to every subscriber that did not time out."""
+        deadline = time.monotonic() - self.timeout
+        for address in [a for a, seen in self.subscribers.items() if seen < deadline]:
+            logging.info(f"Subscriber {address[0]}:{address[1]} timed out")
+            del self.subscribers[address]
+        if not self.subscribers:
+            return
+
+        packed = msgspec.msgpack.encode(self.snapshot())
+        for address in self.subscribers:
+            try:
+                sock.sendto(packed, address)
+                metrics.count(address[0], "sent")
+            except OSError as e:
+                metrics.count(address[0], "send_failed")
+                logging.debug(f"Could not send snapshot to {address[0]}: {e}")
+
+
+class SnapshotService(threading.Thread, DBWrapper):
+    """Subscribes to a hub and inserts the players of its snapshots.
+
+    Replaces receiver and ping back of the mesh, the hub is the only peer.
+    Place and lap of every player in the newest snapshot are kept in
+    ``standings``, in hub mode they replace the local ranking.
+    """
+
+    def __init__(self, database, ip: str, port=None):
+        DBWrapper.__init__(self, database)
+        self.ip = ip
+        self.port = int(port or get_config_option("HUB_PORT"))
+        self.recv_buffer = int(get_config_option("RECV_BUFFER"))
+        # Subscribe again well before the hub forgets us
+        self.resubscribe = float(get_config_option("PLAYER_TIMEOUT")) / 3
+        self.window = int(get_config_option("SEQUENCE_WINDOW"))
+        self.standings: dict[str, tuple[int, int]] = {}
+        self.newest_seq = 0
+
+        threading.Thread.__init__(self)
+
+    def run(self):
+        self.database.post_init()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        logging.debug(f"Subscribing to hub {self.ip}:{self.port}")
+
+        next_subscribe = time.monotonic()
+        while not self.exit:
+            timeout = next_subscribe - time.monotonic()
+            if timeout <= 0:
+                self.subscribe(sock)
+                next_subscribe = time.monotonic() + self.resubscribe
+                continue
+
+            sock.settimeout(timeout)
+            try:
+                message, address = sock.recvfrom(self.recv_buffer)
+            except socket.timeout:
+                continue
+            received = time.monotonic()
+
+            snapshot = self.decode(message, address)
+            if snapshot is not None:
+                self.database.insert_payloads(snapshot.payloads(address[0]))
+                metrics.observe(
+                    "receive_to_insert", (time.monotonic() - received) * 1000
+                )
+
+    def subscribe(self, sock):
+        try:
+            sock.sendto(b"subscribe", (self.ip, self.port))
+        except OSError as e:
+            logging.debug(f"Could not subscribe to hub: {e}")
+
+    def decode(self, message, address) -> WorldSnapshot | None:
+        """Decodes a snapshot, invalid and outdated ones are dropped."""
+        metrics.count(address[0], "received")
+        try:
+            snapshot = snapshot_decoder.decode(message)
+        except msgspec.DecodeError as e:
+            metrics.count(address[0], "rejected")
+            logging.debug(f"Dropped invalid snapshot from {address[0]}: {e}")
+            return None
+
+        metrics.count(address[0], "decoded")
+        # The first or a much older sequence number means the hub restarted
+        if snapshot.seq == 1 or snapshot.seq <= self.newest_seq - self.window:
+            if self.newest_seq:
+                metrics.count(address[0], "restarted")
+        elif snapshot.seq <= self.newest_seq:
+            metrics.count(address[0], "stale")
+            return None
+        self.newest_seq = snapshot.seq
+        if snapshot.sent_at:
+            metrics.observe(
+                "one_way_latency", (time.time() - snapshot.sent_at) * 1000, address[0]
+            )
+        self.standings = {
+            str(entry.player_id): (entry.rank, entry.lap) for entry in snapshot.players
+        }
+        return snapshot
+
+
+class ReceiverProtocol(asyncio.DatagramProtocol):
+    """Receives payloads on the event loop and hands them to the database."""
+
+    def __init__(self, engine: "AsyncKartEngine"):
+        self.engine = engine
+
+    def datagram_received(self, data, addr):
+        payload = decode_datagram(data, addr)
+        if payload is not None:
+            self.engine.submit(Database.insert_payload, payload)
+
+
+class AsyncKartEngine(threading.Thread):
+    """Receiver, sender and ping back on one asyncio loop.
+
+    Replaces the ReceiverService, SenderService and PingBackService threads.
+    Database work runs on a small thread pool, every worker has its own
+    database connection. ``stop`` is the one way to shut it down.
+    """
+
+    def __init__(self, database: DBInfo, ip: str, port: int, send=True):
+        self.db_info = database
+        self.ip = ip
+        self.port = int(port)
+        self.send = send
+        self.batch_points = int(get_config_option("BATCH_POINTS"))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(get_config_option("DB_WORKERS")),
+            thread_name_prefix="fhkart-db",
+        )
+        self.local = threading.local()
+        self.loop = None
+        self.stopping = None
+        self.started = threading.Event()
+
+        threading.Thread.__init__(self)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """Stops the engine from any thread and waits for it."""
+        while not self.started.wait(0.1):
+            if not self.is_alive():
+                return
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        if threading.current_thread() is not self:
+            self.join()
+
+    def database(self) -> Database:
+        """Database of the current worker thread."""
+        database = getattr(self.local, "database", None)
+        if database is None:
+            database = Database(self.db_info)
+            database.post_init()
+            self.local.database = database
+        return database
+
+    def call_database(self, function, *args):
+        return function(self.database(), *args)
+
+    async def query(self, function, *args):
+        """Runs ``function(database, *args)`` on the pool and waits for it."""
+        return await self.loop.run_in_executor(
+            self.executor, self.call_database, function, *args
+        )
+
+    def submit(self, function, *args):
+        """Runs ``function(database, *args)`` on the pool without waiting."""
+        future = self.loop.run_in_executor(
+            self.executor, self.call_database, function, *args
+        )
+        future.add_done_callback(self.log_failure)
+
+    def log_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f"Database task failed: {future.exception()}")
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.me = await self.query(attrgetter("me"))
+
+        receivers = []
+        for address in [(my_ip, self.port), ("localhost", 8191)]:
+            (transport, _) = await self.loop.create_datagram_endpoint(
+                lambda: ReceiverProtocol(self), local_addr=address
+            )
+            receivers.append(transport)
+        # Sender and fan out are separate streams with their own sequence
+        (self.transport, _) = await self.loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, family=socket.AF_INET
+        )
+        (self.fan_out_transport, _) = await self.loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, family=socket.AF_INET
+        )
+        logging.debug("Async engine started")
+        self.started.set()
+
+        tasks = []
+        if self.send:
+            tasks.append(asyncio.create_task(self.send_loop()))
+            tasks.append(asyncio.create_task(self.ping_back_loop()))
+        await self.stopping.wait()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for transport in receivers + [self.transport, self.fan_out_transport]:
+            transport.close()
+        self.executor.shutdown(wait=True)
+        logging.debug("Async engine stopped")
+
+    async def send_loop(self):
+        """Sends my newest point to the target."""
+        self.rate = AdaptiveRate(self.db_info.track)
+        sequence = itertools.count(1)
+        while True:
+            points = await self.query(
+                Database.select_my_newest_points, self.batch_points
+            )
+            if self.rate.should_send(points):
+                ping_batch(self.transport, self.ip, self.port, points, self, sequence)
+            await asyncio.sleep(self.rate.min_interval)
+
+    async def ping_back_loop(self):
+        """Sends my newest point to every active player."""
+        fan_out = FanOut(self.port, self.fan_out_transport)
+        while True:
+            points = await self.query(
+                Database.select_my_newest_points, self.batch_points
+            )
+            players = await self.query(Database.select_active_players)
+            fan_out.send(players, points, self)
+            await asyncio.sleep(fan_out.next_delay())
 
 
 class KartClient:
     def __init__(self, ip, port, database, sender_thread=False):
         self.exit = False
+        self.ingest_writer = IngestWriter(database)
         self.gpsservice = GPSMockService(database)
 
         if sender_thread:
             self.sending_thread = SenderService(database, ip, port)
             self.sending_thread.start()
 
+        self.ingest_writer.start()
         self.gpsservice.start()
 
 
 class KartServer:
     def __init__(self, ip, port, database, args):
-        self.receive_thread = ReceiverService(database, my_ip, port)
-        self.receive_thread_alt = ReceiverService(database, "localhost", 8191)
+        self.ingest_writer = IngestWriter(database)
         self.exit = False
-        self.ping_back = PingBackService(database, port)
 
         if args.mock:
             self.gpsservice = GPSMockService(database)
         else:
             self.gpsservice = GPSService(database)
 
+        self.ingest_writer.start()
+        self.gpsservice.start()
+
+        # With a hub one stream goes up to it and the snapshots come down
+        if args.hub:
+            self.sending_thread = SenderService(database, ip, port)
+            self.snapshot_thread = SnapshotService(database, ip)
+            self.sending_thread.start()
+            self.snapshot_thread.start()
+            return
+
+        # In multicast mode the group replaces sender and ping back, the
+        # unicast receivers stay for peers that are not in the group.
+        if args.multicast:
+            self.multicast = MulticastService(database)
+            self.multicast.start()
+
+        if args.engine == "asyncio":
+            self.engine = AsyncKartEngine(database, ip, port, send=not args.multicast)
+            self.engine.start()
+            return
+
+        workers = int(get_config_option("RECV_WORKERS"))
+        if workers > 0:
+            self.receive_threads = [
+                BatchReceiverService(database, my_ip, port, reuse_port=workers > 1)
+                for _ in range(workers)
+            ]
+        else:
+            self.receive_threads = [ReceiverService(database, my_ip, port)]
+        self.receive_thread_alt = ReceiverService(database, "localhost", 8191)
+        self.ping_back = PingBackService(database, port)
         self.sending_thread = SenderService(database, ip, port)
 
-        self.gpsservice.start()
-        self.receive_thread.start()
+        for receive_thread in self.receive_threads:
+            receive_thread.start()
         self.receive_thread_alt.start()
-        self.sending_thread.start()
-        self.ping_back.start()
+        if not args.multicast:
+            self.sending_thread.start()
+            self.ping_back.start()
+
+    def stop(self):
+        """Shuts the kart down, called once when the process ends.
+
+        The asyncio engine is stopped and waited for. The service threads
+        end at their next loop, a thread blocked in a receive ends when the
+        process exits.
+        """
+        engine = getattr(self, "engine", None)
+        if engine is not None:
+            engine.stop()
+        for value in vars(self).values():
+            for service in value if isinstance(value, list) else [value]:
+                if isinstance(service, DBWrapper):
+                    service.exit = True
+
+
+class HubServer:
+    """Headless hub, karts send to it instead of to each other.
+
+    Receives the points of every kart and sends the world state back to the
+    subscribers, so traffic grows with the number of karts and not with its
+    square.
+    """
+
+    def __init__(self, port, database):
+        self.ingest_writer = IngestWriter(database)
+        self.exit = False
+
+        workers = int(get_config_option("RECV_WORKERS"))
+        if workers > 0:
+            self.receive_threads = [
+                BatchReceiverService(database, my_ip, port, reuse_port=workers > 1)
+                for _ in range(workers)
+            ]
+        else:
+            self.receive_threads = [ReceiverService(database, my_ip, port)]
+        self.hub = HubService(database)
+
+        self.ingest_writer.start()
+        for receive_thread in self.receive_threads:
+            receive_thread.start()
+        self.hub.start()
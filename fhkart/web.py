@@ -1,9 +1,13 @@
+import functools
 import http.server
-import os
 import socketserver
 import threading
+from urllib.parse import parse_qs, urlparse
+
+import msgspec
 
 from .helper import local_path
+from .metrics import metrics
 
 
 class WebService(threading.Thread):
@@ -16,15 +20,33 @@ class WebService(threading.Thread):
 
 class MyHttpRequestHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            return self.send_stats(parse_qs(url.query).get("format", ["json"])[0])
         if self.path == "/":
             self.path = "map.html"
         return http.server.SimpleHTTPRequestHandler.do_GET(self)
 
+    def send_stats(self, format):
+        """Sends the pipeline metrics as json or in the Prometheus text format."""
+        if format == "prometheus":
+            body = metrics.prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = msgspec.json.encode(metrics.snapshot())
+            content_type = "application/json"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
 
 def start_web():
-    # Create an object of the above class
-    os.chdir(local_path)
-    handler_object = MyHttpRequestHandler
+    # Serve the map from the data directory without changing the working
+    # directory of the whole process
+    handler_object = functools.partial(MyHttpRequestHandler, directory=local_path)
 
     PORT = 8000
     my_server = socketserver.TCPServer(("", PORT), handler_object)